@@ -0,0 +1,179 @@
+import mmap
+import os
+import struct
+from pathlib import Path
+
+# hot availability store, kept apart from the static text index / docstore
+#
+#   [header]   magic, version, slot width, number of records
+#   [records]  one fixed width record per room doc id (room x day):
+#              slot count (uint16) + packed bits, bit i = slot i (lsb first)
+#              + earliest start table: byte n - 1 = first slot of a free run of >= n slots
+#                (NO_START when there is none), a duration query is one lookup
+#
+# records are updated in place, so refreshing availability never touches the index
+
+MAGIC = b"SBAV"
+VERSION = 2
+SLOT_WIDTH = 96  # 24h of 15 minute slots
+NO_START = 0xFF
+
+HEADER = struct.Struct("<4sHII")
+SLOT_COUNT = struct.Struct("<H")
+
+
+def bits_size(width):
+    return (width + 7) // 8
+
+def table_offset(width):
+    # offset of the earliest start table inside a record
+    return SLOT_COUNT.size + bits_size(width)
+
+def record_size(width):
+    return table_offset(width) + width
+
+def bitset_to_mask(bitset):
+    # "0110" -> int with bit i set when slot i is free
+    return int(bitset[::-1], 2) if bitset else 0
+
+def free_runs(bitset):
+    # maximal runs of free slots -> [(start slot, length)]
+    runs = []
+    start = None
+    for i, c in enumerate(bitset):
+        if c == "1":
+            if start is None:
+                start = i
+        elif start is not None:
+            runs.append((start, i - start))
+            start = None
+    if start is not None:
+        runs.append((start, len(bitset) - start))
+    return runs
+
+def earliest_starts(runs, width):
+    # byte n - 1 -> first slot starting a run of at least n free slots
+    table = bytearray([NO_START]) * width
+    longest = 0
+    for start, length in runs:
+        # runs come in slot order, so a longer run than any before sets the new entries
+        for n in range(longest + 1, min(length, width) + 1):
+            table[n - 1] = start
+        longest = max(longest, length)
+    return bytes(table)
+
+def pack_bitset(bitset, width, runs=None):
+    if len(bitset) > width:
+        raise ValueError(f"bitset has {len(bitset)} slots, store width is {width}")
+    if width > NO_START:
+        raise ValueError(f"store width {width} does not fit the earliest start table")
+    mask = bitset_to_mask(bitset)
+    if runs is None:
+        runs = free_runs(bitset)
+    return SLOT_COUNT.pack(len(bitset)) + mask.to_bytes(bits_size(width), "little") + earliest_starts(runs, width)
+
+def write_availability_store(path, bitsets, width=SLOT_WIDTH, runs=None):
+    # bitsets: slots bitset strings in room doc id order, runs: their free_runs if already known
+    path = Path(path)
+    tmp_path = path.with_suffix(".tmp")
+    count = 0
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, width, 0))
+        for i, bitset in enumerate(bitsets):
+            f.write(pack_bitset(bitset, width, runs[i] if runs is not None else None))
+            count += 1
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, width, count))
+    os.replace(tmp_path, path)
+
+
+# free run queries on int masks
+def free_run_starts(mask, needed):
+    # bit i of the result is set when slots i .. i + needed - 1 are all free
+    # shift-and with doubling steps -> O(log needed) big int ops
+    if needed <= 0:
+        return mask
+    have = 1
+    while have < needed:
+        step = min(have, needed - have)
+        mask &= mask >> step
+        have += step
+    return mask
+
+def feasible_start_slots(mask, needed):
+    starts = free_run_starts(mask, needed)
+    slots = []
+    while starts:
+        low = starts & -starts
+        slots.append(low.bit_length() - 1)
+        starts ^= low
+    return slots
+
+
+class AvailabilityStore:
+    '''
+    memory mapped availability records, indexed by room doc id
+    '''
+    def __init__(self, path, writable=False):
+        self.path = Path(path)
+        self.writable = writable
+        self.f = open(self.path, "r+b" if writable else "rb")
+        self.mm = None
+        self.remap()
+
+    def remap(self):
+        if self.mm is not None:
+            self.mm.close()
+        access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=access)
+
+        magic, version, width, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not an availability store")
+        if version != VERSION:
+            raise ValueError(f"{self.path} is availability store version {version}, rebuild the index")
+        self.width = width
+        self.rec_size = record_size(width)
+        self.mapped_count = (len(self.mm) - HEADER.size) // self.rec_size
+
+    def __len__(self):
+        return HEADER.unpack_from(self.mm, 0)[3]
+
+    def offset(self, room_doc_id):
+        if room_doc_id >= self.mapped_count:
+            # records appended by another process since we mapped the file
+            self.remap()
+        if room_doc_id < 0 or room_doc_id >= len(self):
+            raise IndexError(room_doc_id)
+        return HEADER.size + room_doc_id * self.rec_size
+
+    def set_bitset(self, room_doc_id, bitset, runs=None):
+        # bits and earliest start table are rewritten together
+        off = self.offset(room_doc_id)
+        self.mm[off:off + self.rec_size] = pack_bitset(bitset, self.width, runs)
+
+    def append(self, bitsets, runs=None):
+        # new room doc ids from an incremental index run
+        count = len(self)
+        self.mm.flush()
+        self.f.seek(0, os.SEEK_END)
+        for i, bitset in enumerate(bitsets):
+            self.f.write(pack_bitset(bitset, self.width, runs[i] if runs is not None else None))
+            count += 1
+        self.f.seek(0)
+        self.f.write(HEADER.pack(MAGIC, VERSION, self.width, count))
+        self.f.flush()
+        self.remap()
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,553 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+from datetime import date, timedelta
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+# benchmark harness: synthetic Study Spots corpus -> index build -> replayed query log
+#
+#   python benchmark.py --spaces 40 --days 14 --rooms 30 --json > bench.json
+#   python benchmark.py --compare bench.json      (same run, prints the change against an older result)
+#   python benchmark.py --startup                 (import budget only: exits 1 when main.py imports too slowly
+#                                                  or pulls in one of HEAVY_MODULES)
+#
+# the build runs in a child process so its peak RSS is not mixed with the query side,
+# results are one json document (corpus, index, query sections) meant to be kept per commit
+
+CAMPUS = (33.6459, -117.8427)
+HOURS = {"start": "08:00", "end": "22:30"}
+SLOT_MINUTES = 30
+SLOT_COUNT = 29
+
+# room profiles seen in the real data: group rooms with whiteboards, single person pods
+GROUP_FEATURES = ["group", "collaborative", "table", "whiteboard"]
+LARGE_FEATURES = ["large", "big", "huge", "display"]
+POD_FEATURES = ["quiet", "single", "private"]
+SPACE_KINDS = ["Library", "Learning Commons", "Study Center", "Hall", "Annex"]
+SPACE_NAMES = ["Science", "Langson", "Gateway", "Engineering", "Humanities", "Arts", "Physics", "Biology",
+               "Social", "Ecology", "Aldrich", "Student", "Anteater", "Bren", "Merage", "Rowland"]
+
+QUERY_WORDS = GROUP_FEATURES + LARGE_FEATURES + POD_FEATURES + ["study", "pod", "tech", "enhanced", "room"]
+DURATIONS = [30, 45, 60, 90, 120, 180]
+CAPACITIES = [None, None, None, 1, 2, 4, 6, 8]
+
+# start up: batch jobs spawn the cli entry point over and over
+STARTUP_MODULE = "main"
+STARTUP_BUDGET_MS = 400
+HEAVY_MODULES = ["nltk", "pytz", "googleapiclient", "google.oauth2", "google_auth_oauthlib"]
+
+
+# corpus
+def synthetic_bitset(rng, slot_count=SLOT_COUNT):
+    # mostly free days with a few bookings of 1-4 hours, now and then a fully booked room
+    if rng.random() < 0.03:
+        return "0" * slot_count
+    slots = ["1"] * slot_count
+    for _ in range(rng.choice([0, 1, 1, 2, 2, 3, 4])):
+        length = rng.randint(2, 8)
+        start = rng.randrange(0, slot_count)
+        for i in range(start, min(start + length, slot_count)):
+            slots[i] = "0"
+    return "".join(slots)
+
+def synthetic_rooms(rng, space_id, space_name, num_rooms):
+    rooms = []
+    for r in range(num_rooms):
+        if rng.random() < 0.3:
+            features = list(POD_FEATURES)
+            name = f"Study Pod {r // 5 + 1}{'ABCDE'[r % 5]}"
+            capacity = 1
+        else:
+            features = list(GROUP_FEATURES)
+            if rng.random() < 0.1:
+                features.remove("whiteboard")
+            capacity = rng.choice([4, 4, 4, 5, 5, 6, 8])
+            if capacity >= 6:
+                features += rng.sample(LARGE_FEATURES, rng.randint(1, 2))
+            name = f"{space_name.split()[0]} {100 + 7 * r}"
+            if rng.random() < 0.2:
+                name += " (Tech Enhanced)"
+                features.append("display")
+        rooms.append({
+            "id": f"{space_id}-{r}",
+            "name": name,
+            "capacity": capacity,
+            "features": list(dict.fromkeys(features))
+        })
+    return rooms
+
+def generate_corpus(out_dir, num_spaces, num_days, num_rooms, seed=125, start_day=date(2026, 2, 2)):
+    '''
+    writes num_spaces x num_days files of num_rooms rooms in the Study Spots format
+    returns corpus stats
+    '''
+    rng = random.Random(seed)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    files = 0
+    total_bytes = 0
+
+    for s in range(num_spaces):
+        space_name = f"{SPACE_NAMES[s % len(SPACE_NAMES)]} {SPACE_KINDS[(s // len(SPACE_NAMES)) % len(SPACE_KINDS)]}"
+        if s >= len(SPACE_NAMES) * len(SPACE_KINDS):
+            space_name += f" {s}"
+        space_id = f"space{s:04d}"
+        space = {
+            "id": space_id,
+            "name": space_name,
+            "timezone": "America/Los_Angeles",
+            "hours": HOURS,
+            "slot_minutes": SLOT_MINUTES,
+            "slot_count": SLOT_COUNT,
+            # spread over campus and nearby, ~2km
+            "location": {"lat": round(CAMPUS[0] + rng.gauss(0, 0.01), 6), "lon": round(CAMPUS[1] + rng.gauss(0, 0.01), 6)}
+        }
+        rooms = synthetic_rooms(rng, space_id, space_name, num_rooms)
+
+        space_dir = out_dir / space_id
+        space_dir.mkdir(exist_ok=True)
+        for d in range(num_days):
+            day = (start_day + timedelta(days=d)).isoformat()
+            data = {
+                "space": space,
+                "date": day,
+                "rooms": [dict(room, slots_bitset=synthetic_bitset(rng)) for room in rooms]
+            }
+            path = space_dir / f"{space_id}_{day}.json"
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            files += 1
+            total_bytes += path.stat().st_size
+
+    return {
+        "spaces": num_spaces,
+        "days": num_days,
+        "rooms_per_space": num_rooms,
+        "room_docs": num_spaces * num_days * num_rooms,
+        "files": files,
+        "bytes": total_bytes,
+        "seed": seed
+    }
+
+
+# query log
+def synthetic_query(rng, space_names):
+    words = rng.sample(QUERY_WORDS, rng.randint(1, 3))
+    kind = rng.random()
+    if kind < 0.15:
+        text = " AND ".join(words[:2])
+    elif kind < 0.25:
+        text = f"{words[0]} NOT {rng.choice(QUERY_WORDS)}"
+    elif kind < 0.35:
+        text = f"feature:{words[0]} " + " ".join(words[1:])
+    elif kind < 0.5:
+        text = f"{rng.choice(space_names).split()[0].lower()} " + " ".join(words)
+    elif kind < 0.55:
+        text = f"capacity {rng.choice([4, 6, 8])}"
+    else:
+        text = " ".join(words)
+
+    req = {
+        "query": text.strip(),
+        "min_capacity": rng.choice(CAPACITIES),
+        "duration_minutes": rng.choice(DURATIONS),
+        "k": 5,
+        "user_location": [round(CAMPUS[0] + rng.gauss(0, 0.01), 6), round(CAMPUS[1] + rng.gauss(0, 0.01), 6)]
+                         if rng.random() < 0.7 else None
+    }
+    if req["user_location"] and rng.random() < 0.2:
+        req["max_distance_m"] = rng.choice([300, 800, 1500])
+    return req
+
+def make_query_log(n, seed=125, num_spaces=len(SPACE_NAMES)):
+    rng = random.Random(seed)
+    names = SPACE_NAMES[:max(1, min(num_spaces, len(SPACE_NAMES)))]
+    return [synthetic_query(rng, names) for _ in range(n)]
+
+def load_query_log(path):
+    # one json object per line: search bodies as the server takes them,
+    # lines without a "query" (e.g. a backlog / request log) replay their title as the query text
+    log = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            if "query" not in row:
+                if not row.get("title"):
+                    continue
+                row = {"query": row["title"]}
+            log.append(row)
+    return log
+
+
+# measurements
+def peak_rss_mb(children=False):
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def dir_sizes(path):
+    sizes = {}
+    for p in sorted(Path(path).rglob("*")):
+        if p.is_file():
+            sizes[p.relative_to(path).as_posix()] = p.stat().st_size
+    return sizes
+
+def build_benchmark_index(corpus_dir, index_root, batch_size, workers):
+    # child process side: the same steps as indexer.build_index, timed one by one
+    import indexer
+    from segment import new_segment_dir, publish_segment, write_segment_header
+
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        seg_dir = new_segment_dir(index_root)
+
+        t0 = time.perf_counter()
+        if workers > 1:
+            num_docs, runs = indexer.make_parallel_inverted_indexes(corpus_dir, seg_dir, batch_size, workers, 1)
+        else:
+            num_docs, num_runs = indexer.make_partial_inverted_indexes(corpus_dir, seg_dir, batch_size, 1)
+            runs = [(indexer.run_path(seg_dir, run_id), 0) for run_id in range(num_runs)]
+        timings["make_partial"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        indexer.merge_runs(seg_dir, runs)
+        timings["merge"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        indexer.index_analytics(seg_dir, num_docs)
+        indexer.save_stem_cache(seg_dir)
+        write_segment_header(seg_dir, 1, num_docs=num_docs)
+        seg_dir = publish_segment(index_root, seg_dir)
+        timings["finish"] = time.perf_counter() - t0
+
+    return {
+        "num_docs": num_docs,
+        "num_runs": len(runs),
+        "seconds": {name: round(t, 4) for name, t in timings.items()},
+        "peak_rss_mb": peak_rss_mb(),
+        "segment": seg_dir.name
+    }
+
+def bench_index(corpus_dir, index_root, corpus, batch_size=10000, workers=1):
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        result = pool.submit(build_benchmark_index, corpus_dir, index_root, batch_size, workers).result()
+
+    total = sum(result["seconds"].values())
+    result["seconds"]["total"] = round(total, 4)
+    result["workers"] = workers
+    result["batch_size"] = batch_size
+    result["rooms_per_second"] = round(result["num_docs"] / total, 1) if total else 0.0
+    result["source_mb_per_second"] = round(corpus["bytes"] / (1024 * 1024) / total, 2) if total else 0.0
+
+    files = dir_sizes(Path(index_root) / result["segment"])
+    result["disk_bytes"] = sum(files.values())
+    result["files"] = files
+    return result
+
+def latency_summary(latencies):
+    from loadgen import percentile
+    latencies = sorted(latencies)
+    return {
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "max": round(latencies[-1], 3) if latencies else 0.0,
+        "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0
+    }
+
+def bench_queries(index_root, query_log, warmup=50):
+    import retrieval
+    from querycache import QueryCache
+    from server import BadRequest, parse_search
+
+    retrieval.INDEX_DIR = Path(index_root)
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        retrieval.load_room_docstore()
+    load_seconds = time.perf_counter() - t0
+
+    # every query is scored, the result cache would only measure dict lookups
+    retrieval.QUERY_CACHE = QueryCache(max_entries=0)
+    traces = []
+
+    searches = []
+    for req in query_log:
+        try:
+            searches.append(parse_search(req))
+        except BadRequest:
+            continue
+
+    def run(search):
+        s = dict(search)
+        query = s.pop("query")
+        return retrieval.retrieve_batch([query], s, verbose=False, traces=traces)[0]
+
+    for search in searches[:warmup]:
+        run(search)
+    del traces[:]
+
+    latencies = []
+    empty = 0
+    t0 = time.perf_counter()
+    for search in searches:
+        q0 = time.perf_counter()
+        results = run(search)
+        latencies.append((time.perf_counter() - q0) * 1000)
+        empty += not results
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "count": len(latencies),
+        "warmup": min(warmup, len(searches)),
+        "empty_results": empty,
+        "index_load_seconds": round(load_seconds, 4),
+        "seconds": round(elapsed, 4),
+        "queries_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": latency_summary(latencies),
+        "stages": stage_summary(traces),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def stage_summary(traces):
+    # per stage: mean ms per query and candidates in / out over the whole log
+    stages = {}
+    for trace in traces:
+        for name, s in trace["stages"].items():
+            total = stages.setdefault(name, {"ms": 0.0, "in": 0, "out": 0})
+            total["ms"] += s["ms"]
+            total["in"] += s["in"]
+            total["out"] += s["out"]
+    for total in stages.values():
+        total["mean_ms"] = round(total.pop("ms") / max(len(traces), 1), 4)
+    return stages
+
+
+def parse_importtime(stderr):
+    # python -X importtime lines -> [(nesting level, module, cumulative us)]
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((level, name.strip(), int(cumulative)))
+    return rows
+
+def bench_startup(module=STARTUP_MODULE, runs=5):
+    '''
+    imports module in fresh interpreters, returns the median import time, the slowest
+    direct imports of the module and which HEAVY_MODULES ended up loaded
+    '''
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    import_us, wall_ms, children, loaded = [], [], {}, set()
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=Path(__file__).parent,
+                             capture_output=True, text=True)
+        wall_ms.append((time.perf_counter() - t0) * 1000)
+        if out.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{out.stderr[-2000:]}")
+        loaded.update(out.stdout.split())
+
+        rows = parse_importtime(out.stderr)
+        import_us.append(next(us for level, name, us in reversed(rows) if level == 0 and name == module))
+        # the module's own imports are listed right before it, one level deeper
+        for level, name, us in reversed(rows[:-1]):
+            if level == 0:
+                break
+            if level == 1:
+                children.setdefault(name, []).append(us)
+
+    slowest = sorted(((name, sorted(us)[len(us) // 2] / 1000) for name, us in children.items()),
+                     key=lambda item: -item[1])[:8]
+    return {
+        "module": module,
+        "runs": runs,
+        "import_ms": round(sorted(import_us)[len(import_us) // 2] / 1000, 1),
+        "process_ms": round(sorted(wall_ms)[len(wall_ms) // 2], 1),
+        "slowest_imports_ms": {name: round(ms, 1) for name, ms in slowest},
+        "heavy_modules": [m for m in HEAVY_MODULES if m in loaded]
+    }
+
+def check_startup(startup, budget_ms=STARTUP_BUDGET_MS):
+    # problems as text, empty when the import fits the budget
+    problems = []
+    if startup["import_ms"] > budget_ms:
+        problems.append(f"import {startup['module']} took {startup['import_ms']} ms, budget {budget_ms} ms")
+    if startup["heavy_modules"]:
+        problems.append(f"import {startup['module']} loaded {', '.join(startup['heavy_modules'])}")
+    return problems
+
+def print_startup(startup):
+    print(f"Startup: import {startup['module']} {startup['import_ms']} ms, "
+          f"process {startup['process_ms']} ms (median of {startup['runs']})")
+    for name, ms in startup["slowest_imports_ms"].items():
+        print(f"    {name}: {ms} ms")
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                             capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+def run_benchmark(args):
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="studybench-"))
+    corpus_dir = work_dir / "Study Spots"
+    index_root = work_dir / "Index"
+    for p in (corpus_dir, index_root):
+        if p.exists():
+            shutil.rmtree(p)
+
+    try:
+        print(f"Generating {args.spaces} spaces x {args.days} days x {args.rooms} rooms...", file=sys.stderr)
+        corpus = generate_corpus(corpus_dir, args.spaces, args.days, args.rooms, args.seed)
+
+        print(f"Indexing {corpus['room_docs']} rooms...", file=sys.stderr)
+        index = bench_index(corpus_dir, index_root, corpus, args.batch_size, args.workers)
+
+        if args.queries:
+            query_log = load_query_log(args.queries)
+            query_source = str(args.queries)
+        else:
+            query_log = make_query_log(args.num_queries, args.seed, args.spaces)
+            query_source = f"synthetic (seed {args.seed})"
+        if args.save_queries:
+            with open(args.save_queries, "w", encoding="utf-8") as f:
+                for req in query_log:
+                    f.write(json.dumps(req) + "\n")
+
+        print(f"Replaying {len(query_log)} queries...", file=sys.stderr)
+        query = bench_queries(index_root, query_log, args.warmup)
+        query["source"] = query_source
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": corpus,
+        "index": index,
+        "query": query,
+        "startup": bench_startup()
+    }
+
+# metric -> True when higher is better
+COMPARE_METRICS = {
+    ("index", "seconds", "total"): False,
+    ("index", "rooms_per_second"): True,
+    ("index", "peak_rss_mb"): False,
+    ("index", "disk_bytes"): False,
+    ("query", "queries_per_second"): True,
+    ("query", "latency_ms", "p50"): False,
+    ("query", "latency_ms", "p95"): False,
+    ("query", "latency_ms", "p99"): False,
+    ("query", "peak_rss_mb"): False,
+    ("startup", "import_ms"): False
+}
+
+def compare_reports(old, new):
+    rows = []
+    for path, higher_is_better in COMPARE_METRICS.items():
+        a, b = old, new
+        for key in path:
+            a = a.get(key) if isinstance(a, dict) else None
+            b = b.get(key) if isinstance(b, dict) else None
+        if not a or b is None:
+            continue
+        change = (b - a) / a
+        better = change > 0 if higher_is_better else change < 0
+        rows.append((".".join(path), a, b, change, better))
+    return rows
+
+def print_report(report):
+    corpus, index, query = report["corpus"], report["index"], report["query"]
+    s = index["seconds"]
+    lat = query["latency_ms"]
+    print(f"Corpus: {corpus['room_docs']} rooms in {corpus['files']} files ({corpus['bytes'] / 1024 / 1024:.1f} MB)")
+    print(f"Index: {s['total']} s (partial {s['make_partial']} s, merge {s['merge']} s, finish {s['finish']} s), "
+          f"{index['rooms_per_second']} rooms/s, peak RSS {index['peak_rss_mb']} MB, {index['disk_bytes'] / 1024 / 1024:.2f} MB on disk")
+    print(f"Query: {query['count']} queries, {query['queries_per_second']} queries/s, "
+          f"p50 {lat['p50']} ms | p95 {lat['p95']} ms | p99 {lat['p99']} ms, peak RSS {query['peak_rss_mb']} MB")
+    for name, stage in query.get("stages", {}).items():
+        counts = f", candidates {stage['in']} -> {stage['out']}" if stage["in"] or stage["out"] else ""
+        print(f"    {name}: {stage['mean_ms']} ms/query{counts}")
+    if "startup" in report:
+        print_startup(report["startup"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexing and retrieval benchmark on a synthetic Study Spots corpus")
+    parser.add_argument("--spaces", type=int, default=20)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--rooms", type=int, default=25, help="rooms per space")
+    parser.add_argument("--seed", type=int, default=125)
+    parser.add_argument("--workers", type=int, default=1, help="indexing processes, > 1 uses the parallel build")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rooms per partial run")
+    parser.add_argument("--queries", help="query log to replay (jsonl), default: synthetic")
+    parser.add_argument("--num-queries", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--save-queries", help="write the replayed query log here (jsonl)")
+    parser.add_argument("--work-dir", help="keep corpus and index here instead of a temp dir")
+    parser.add_argument("--out", help="write the json report to this file")
+    parser.add_argument("--compare", help="older json report to compare against")
+    parser.add_argument("--json", action="store_true", help="print the json report instead of a summary")
+    parser.add_argument("--startup", action="store_true", help="only check the import time of main.py against the budget")
+    parser.add_argument("--import-budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    args = parser.parse_args()
+
+    if args.startup:
+        startup = bench_startup()
+        if args.json:
+            print(json.dumps(startup, indent=2))
+        else:
+            print_startup(startup)
+        problems = check_startup(startup, args.import_budget_ms)
+        for problem in problems:
+            print(f"Over budget: {problem}", file=sys.stderr)
+        sys.exit(1 if problems else 0)
+
+    report = run_benchmark(args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        print(f"\nCompared to {old.get('commit') or args.compare}:", file=sys.stderr if args.json else sys.stdout)
+        for name, a, b, change, better in compare_reports(old, report):
+            mark = "better" if better else ("worse" if change else "same")
+            print(f"  {name}: {a} -> {b} ({change:+.1%}, {mark})", file=sys.stderr if args.json else sys.stdout)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import heapq
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+# free/busy engine: busy intervals are merged once into two sorted tuples (starts, ends)
+# a free window query is a bisect to the first busy interval ending after the window start,
+# then a walk over the intervals inside the window -> O(log n + k) per day instead of O(n)
+#
+# the calendar never touches the interval dicts it was built from
+
+
+def interval_pair(interval):
+    # {'start': dt, 'end': dt} (freebusy api / mock file) or (start, end)
+    if isinstance(interval, dict):
+        return interval["start"], interval["end"]
+    return interval[0], interval[1]
+
+def coalesce(pairs):
+    # pairs sorted by start -> merged, touching intervals are joined
+    starts, ends = [], []
+    for start, end in pairs:
+        if end <= start:
+            continue
+        if ends and start <= ends[-1]:
+            if end > ends[-1]:
+                ends[-1] = end
+        else:
+            starts.append(start)
+            ends.append(end)
+    return tuple(starts), tuple(ends)
+
+
+class BusyCalendar:
+    def __init__(self, busy_intervals=(), presorted=False):
+        pairs = [interval_pair(b) for b in busy_intervals or ()]
+        if not presorted:
+            pairs.sort(key=lambda p: p[0])
+        self.starts, self.ends = coalesce(pairs)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def intervals(self):
+        return list(zip(self.starts, self.ends))
+
+    def is_free(self, start, end):
+        # no merged busy interval overlaps [start, end)
+        i = bisect_right(self.ends, start)
+        return i == len(self.starts) or self.starts[i] >= end
+
+    def busy_between(self, window_start, window_end):
+        # merged busy intervals overlapping the window, clipped to it
+        i = bisect_right(self.ends, window_start)
+        j = bisect_left(self.starts, window_end, lo=i)
+        return [(max(self.starts[k], window_start), min(self.ends[k], window_end)) for k in range(i, j)]
+
+    def free_windows(self, window_start, window_end, min_duration_minutes=0):
+        free = []
+        pointer = window_start
+        for busy_start, busy_end in self.busy_between(window_start, window_end):
+            if pointer < busy_start:
+                free.append((pointer, busy_start))
+            pointer = max(pointer, busy_end)
+        if pointer < window_end:
+            free.append((pointer, window_end))
+
+        if min_duration_minutes > 0:
+            free = [(s, e) for s, e in free if (e - s).total_seconds() >= min_duration_minutes * 60]
+        return free
+
+    def free_windows_for_day(self, day, tz, start_hour=8, end_hour=22, min_duration=30):
+        window_start, window_end = day_window(day, tz, start_hour, end_hour)
+        return self.free_windows(window_start, window_end, min_duration)
+
+    def free_windows_by_day(self, days, tz, start_hour=8, end_hour=22, min_duration=30):
+        # multi week horizons: one bisect per day over the same merged arrays
+        return [(day, self.free_windows_for_day(day, tz, start_hour, end_hour, min_duration)) for day in days]
+
+
+def day_window(day, tz, start_hour=8, end_hour=22):
+    window_start = tz.localize(datetime.combine(day, datetime.min.time()).replace(hour=start_hour))
+    window_end = tz.localize(datetime.combine(day, datetime.min.time()).replace(hour=end_hour))
+    return window_start, window_end
+
+def as_calendar(busy_intervals):
+    if isinstance(busy_intervals, BusyCalendar):
+        return busy_intervals
+    return BusyCalendar(busy_intervals)
+
+def union_calendars(calendars):
+    # several users -> busy whenever anyone is busy, free windows are the common ones
+    # every calendar is already sorted, so this is a k-way merge, no re-sort
+    calendars = [as_calendar(c) for c in calendars]
+    merged = BusyCalendar()
+    merged.starts, merged.ends = coalesce(heapq.merge(*(zip(c.starts, c.ends) for c in calendars)))
+    return merged
@@ -0,0 +1,141 @@
+import os
+import json
+from datetime import datetime, timedelta, timezone
+
+# calendar providers: busy intervals for the next days_ahead days, looked up by name and
+# imported on first use, so an offline start never loads the google client libraries
+#
+#   STUDY_BUDDIES_CALENDAR=auto     google when token.json / credentials.json exist, else the mock week (default)
+#   STUDY_BUDDIES_CALENDAR=google   google calendar freebusy api (input.py)
+#   STUDY_BUDDIES_CALENDAR=mock     Schedules/mockweek.json as is
+#   STUDY_BUDDIES_CALENDAR=fake     local fake freebusy service, the mock week replayed over the next 7 days
+#
+# a provider is provider(calendar_ids, days_ahead) -> [{'start': dt, 'end': dt}] or None when unavailable
+
+CALENDAR_PROVIDER = os.environ.get("STUDY_BUDDIES_CALENDAR", "auto")
+MOCK_SCHEDULE = os.environ.get("STUDY_BUDDIES_MOCK_SCHEDULE", "Schedules/mockweek.json")
+TOKEN_FILE = "token.json"
+CREDENTIALS_FILE = "credentials.json"
+
+
+def google_provider(calendar_ids, days_ahead):
+    from input import fetch_freebusy_from_api
+    return fetch_freebusy_from_api(calendar_ids, days_ahead)
+
+def mock_provider(calendar_ids, days_ahead):
+    from input import parse_google_freebusy
+    mock_json = load_mock_schedule()
+    return parse_google_freebusy(mock_json) if mock_json is not None else None
+
+def fake_provider(calendar_ids, days_ahead):
+    from input import fetch_freebusy_from_api
+    mock_json = load_mock_schedule()
+    if mock_json is None:
+        return None
+    # the mock file is written for one account, every requested calendar gets its week
+    busy = replay_week(busy_from_freebusy_json(mock_json))
+    service = FakeFreeBusyService({cal_id: busy for cal_id in calendar_ids})
+    return fetch_freebusy_from_api(calendar_ids, days_ahead, service=service, namespace="fake")
+
+PROVIDERS = {
+    "google": google_provider,
+    "mock": mock_provider,
+    "fake": fake_provider
+}
+
+def register_provider(name, provider):
+    PROVIDERS[name] = provider
+
+def has_google_credentials():
+    # without either file the google flow can only fail (no browser login in batch jobs)
+    return os.path.exists(TOKEN_FILE) or os.path.exists(CREDENTIALS_FILE)
+
+def load_busy_intervals(calendar_ids, days_ahead=7, provider=None):
+    '''
+    busy intervals from the configured provider -> (busy intervals or None, provider name used)
+    auto tries google first and falls back to the mock week, like the cli always did
+    '''
+    name = provider or CALENDAR_PROVIDER
+    if name == "auto":
+        if has_google_credentials():
+            busy_intervals = PROVIDERS["google"](calendar_ids, days_ahead)
+            if busy_intervals is not None:
+                return busy_intervals, "google"
+        return PROVIDERS["mock"](calendar_ids, days_ahead), "mock"
+
+    if name not in PROVIDERS:
+        print(f"Unknown calendar provider {name!r}, expected one of {', '.join(sorted(PROVIDERS))} or auto")
+        return None, name
+    return PROVIDERS[name](calendar_ids, days_ahead), name
+
+
+def load_mock_schedule(path=None):
+    try:
+        with open(path or MOCK_SCHEDULE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def format_time(dt):
+    return dt.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+def busy_from_freebusy_json(json_response):
+    # every calendar's busy list as (start, end) pairs, merged into one list
+    busy = []
+    for data in json_response.get('calendars', {}).values():
+        busy.extend((parse_time(b['start']), parse_time(b['end'])) for b in data.get('busy', []))
+    return sorted(busy)
+
+def replay_week(busy, today=None):
+    # every interval moves by whole weeks into the 7 days from today, keeping its weekday and time of day
+    today = today or datetime.now(timezone.utc).date()
+    shifted = []
+    for start, end in busy:
+        offset = timedelta(weeks=-((start.date() - today).days // 7))
+        shifted.append((start + offset, end + offset))
+    return sorted(shifted)
+
+
+class FakeRequest:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+class FakeFreeBusyService:
+    '''
+    local stand-in for the google calendar service object:
+    service.freebusy().query(body=...).execute() answers from in-memory busy intervals,
+    merged and clipped to timeMin / timeMax like the real endpoint. requests keeps every body it saw
+    '''
+    def __init__(self, busy=None):
+        from busycalendar import coalesce
+        self.busy = {cal_id: list(zip(*coalesce(sorted(intervals)))) for cal_id, intervals in (busy or {}).items()}
+        self.requests = []
+
+    def freebusy(self):
+        return self
+
+    def query(self, body):
+        self.requests.append(body)
+        time_min, time_max = parse_time(body['timeMin']), parse_time(body['timeMax'])
+        calendars = {}
+        for item in body.get('items', []):
+            cal_id = item['id']
+            if cal_id not in self.busy:
+                calendars[cal_id] = {'errors': [{'domain': 'global', 'reason': 'notFound'}], 'busy': []}
+                continue
+            calendars[cal_id] = {'busy': [
+                {'start': format_time(max(start, time_min)), 'end': format_time(min(end, time_max))}
+                for start, end in self.busy[cal_id] if start < time_max and end > time_min
+            ]}
+        return FakeRequest({
+            'kind': 'calendar#freeBusy',
+            'timeMin': format_time(time_min),
+            'timeMax': format_time(time_max),
+            'calendars': calendars
+        })
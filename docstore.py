@@ -0,0 +1,121 @@
+import json
+import mmap
+import sys
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+from pathlib import Path
+
+# room docstore, read lazily
+#   roomdocstore.jsonl   one json record per room doc id, the space block is a "space_ref"
+#   roomdocstore.off     byte offset of every record (little endian uint64)
+#   roomspaces.jsonl     {"ref": ..., "space": {...}} shared by every room of a space and day
+# records are decoded on access, only a small LRU of decoded records is kept
+
+SPACES_NAME = "roomspaces.jsonl"
+RECORD_CACHE_SIZE = 4096
+
+
+def read_offsets(path):
+    offsets = array("Q")
+    with open(path, "rb") as f:
+        offsets.frombytes(f.read())
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    return offsets
+
+def scan_offsets(mm):
+    # docstores without an offsets file (older indexes): one pass over the lines
+    offsets = array("Q")
+    pos = 0
+    size = len(mm) if mm is not None else 0
+    while pos < size:
+        offsets.append(pos)
+        end = mm.find(b"\n", pos)
+        pos = size if end < 0 else end + 1
+    return offsets
+
+def load_spaces(path):
+    spaces = {}
+    path = Path(path)
+    if not path.exists():
+        return spaces
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            spaces[row["ref"]] = row["space"]
+    return spaces
+
+
+class DocStore(Mapping):
+    def __init__(self, path, offsets_path=None, spaces_path=None, cache_size=RECORD_CACHE_SIZE):
+        path = Path(path)
+        self.file = open(path, "rb")
+        size = path.stat().st_size
+        self.mm = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ) if size else None
+
+        offsets_path = Path(offsets_path) if offsets_path else None
+        if offsets_path is not None and offsets_path.exists():
+            self.offsets = read_offsets(offsets_path)
+        else:
+            self.offsets = scan_offsets(self.mm)
+
+        # records appended after the mapping was made are not visible
+        while self.offsets and self.offsets[-1] >= size:
+            self.offsets.pop()
+
+        self.spaces = load_spaces(spaces_path) if spaces_path else {}
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(range(len(self.offsets)))
+
+    def __contains__(self, roomdoc_id):
+        return isinstance(roomdoc_id, int) and 0 <= roomdoc_id < len(self.offsets)
+
+    def decode(self, roomdoc_id):
+        start = self.offsets[roomdoc_id]
+        end = self.offsets[roomdoc_id + 1] if roomdoc_id + 1 < len(self.offsets) else self.mm.find(b"\n", start) + 1
+        record = json.loads(self.mm[start:end or len(self.mm)])
+
+        # shared dict, callers treat records as read only
+        ref = record.pop("space_ref", None)
+        if ref is not None:
+            record["space"] = self.spaces[ref]
+        return record
+
+    def __getitem__(self, roomdoc_id):
+        if roomdoc_id not in self:
+            raise KeyError(roomdoc_id)
+
+        record = self.cache.get(roomdoc_id)
+        if record is not None:
+            self.cache.move_to_end(roomdoc_id)
+            return record
+
+        record = self.cache[roomdoc_id] = self.decode(roomdoc_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return record
+
+    def items(self):
+        # sequential scan without filling the record cache
+        for roomdoc_id in range(len(self.offsets)):
+            yield roomdoc_id, self.decode(roomdoc_id)
+
+    def close(self):
+        self.cache.clear()
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
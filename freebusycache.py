@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from calendars import FakeFreeBusyService, format_time, parse_time
+
+# free/busy cache: busy intervals per calendar id, kept on disk with the time ranges they cover.
+# every covered range remembers when it was fetched, a request for [time_min, time_max) is
+# answered from the ranges still inside the TTL and only the uncovered gaps go to the endpoint
+# (a window grown from 7 to 14 days fetches the second week only, a relaunch within the TTL fetches nothing)
+#
+# windows are widened to ALIGN_MINUTES boundaries, so launches a few seconds apart ask for the same range
+#
+#   {"version": 1, "calendars": {"google/primary": [{"start", "end", "fetched_at", "busy": [[start, end], ...]}]}}
+
+FREEBUSY_CACHE_PATH = os.environ.get("STUDY_BUDDIES_FREEBUSY_CACHE", "freebusy_cache.json")  # empty -> no cache
+FREEBUSY_TTL = float(os.environ.get("STUDY_BUDDIES_FREEBUSY_TTL", 900))
+ALIGN_MINUTES = 60
+CACHE_VERSION = 1
+
+
+def to_utc(dt):
+    return dt.astimezone(timezone.utc)
+
+def floor_time(dt, minutes):
+    ts = to_utc(dt).timestamp()
+    return datetime.fromtimestamp(ts - ts % (minutes * 60), timezone.utc)
+
+def ceil_time(dt, minutes):
+    ts = to_utc(dt).timestamp()
+    rest = ts % (minutes * 60)
+    return datetime.fromtimestamp(ts + (minutes * 60 - rest if rest else 0), timezone.utc)
+
+def uncovered(start, end, ranges):
+    # parts of [start, end) outside the sorted, disjoint ranges
+    gaps = []
+    pointer = start
+    for r in ranges:
+        if r["end"] <= pointer:
+            continue
+        if r["start"] >= end:
+            break
+        if r["start"] > pointer:
+            gaps.append((pointer, r["start"]))
+        pointer = max(pointer, r["end"])
+    if pointer < end:
+        gaps.append((pointer, end))
+    return gaps
+
+def cache_key(namespace, calendar_id):
+    return f"{namespace}/{calendar_id}"
+
+
+class FreeBusyCache:
+    def __init__(self, path=FREEBUSY_CACHE_PATH, ttl_seconds=FREEBUSY_TTL, align_minutes=ALIGN_MINUTES):
+        self.path = Path(path) if path else None
+        self.ttl_seconds = ttl_seconds
+        self.align_minutes = align_minutes
+        self.calendars = {}  # cache key -> covered ranges sorted by start
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+
+    def fresh_ranges(self, key, now):
+        ranges = [r for r in self.calendars.get(key, []) if r["fetched_at"] + self.ttl_seconds >= now]
+        if ranges:
+            self.calendars[key] = ranges
+        else:
+            self.calendars.pop(key, None)
+        return ranges
+
+    def busy_intervals(self, calendar_ids, time_min, time_max, fetch, namespace="google"):
+        '''
+        busy intervals of all calendar_ids inside [time_min, time_max) as [{'start', 'end'}], clipped to it
+        fetch(calendar_ids, start, end) -> {calendar id: [(start, end)]} is called once per uncovered range,
+        calendars missing from its answer (api errors) are returned without being cached
+        '''
+        if not self.loaded:
+            self.load()
+        now = time.time()
+        start = floor_time(time_min, self.align_minutes)
+        end = ceil_time(time_max, self.align_minutes)
+
+        # calendars sharing a gap are fetched in one request
+        gaps = {}
+        for cal_id in calendar_ids:
+            for gap in uncovered(start, end, self.fresh_ranges(cache_key(namespace, cal_id), now)):
+                gaps.setdefault(gap, []).append(cal_id)
+
+        for (gap_start, gap_end), ids in sorted(gaps.items()):
+            answer = fetch(ids, gap_start, gap_end)
+            self.fetches += 1
+            for cal_id in ids:
+                if cal_id not in answer:
+                    continue
+                intervals = sorted((to_utc(s), to_utc(e)) for s, e in answer[cal_id])
+                ranges = self.calendars.setdefault(cache_key(namespace, cal_id), [])
+                ranges.append({"start": gap_start, "end": gap_end, "fetched_at": now, "busy": intervals})
+                ranges.sort(key=lambda r: r["start"])
+
+        if gaps:
+            self.misses += 1
+            self.save()
+        else:
+            self.hits += 1
+
+        busy = []
+        time_min, time_max = to_utc(time_min), to_utc(time_max)
+        for cal_id in calendar_ids:
+            pieces = []
+            for r in self.calendars.get(cache_key(namespace, cal_id), []):
+                for s, e in r["busy"]:
+                    if s >= time_max or e <= time_min:
+                        continue
+                    # the endpoint clips to the requested range, an event across two fetches comes back in two pieces
+                    if pieces and pieces[-1][1] == s == r["start"]:
+                        pieces[-1] = (pieces[-1][0], min(e, time_max))
+                    else:
+                        pieces.append((max(s, time_min), min(e, time_max)))
+            busy.extend(pieces)
+        return [{'start': s, 'end': e} for s, e in sorted(busy)]
+
+    def clear(self):
+        self.calendars.clear()
+
+    def stats(self):
+        return {
+            "calendars": len(self.calendars),
+            "ranges": sum(len(ranges) for ranges in self.calendars.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "fetches": self.fetches
+        }
+
+    # written after every fetch, a new process starts from what the last one saw
+    def save(self):
+        if self.path is None:
+            return
+        now = time.time()
+        data = {
+            "version": CACHE_VERSION,
+            "calendars": {
+                key: [
+                    {
+                        "start": format_time(r["start"]),
+                        "end": format_time(r["end"]),
+                        "fetched_at": r["fetched_at"],
+                        "busy": [[format_time(s), format_time(e)] for s, e in r["busy"]]
+                    }
+                    for r in ranges if r["fetched_at"] + self.ttl_seconds >= now
+                ]
+                for key, ranges in self.calendars.items()
+            }
+        }
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not write free/busy cache {self.path}: {e}")
+
+    def load(self):
+        self.loaded = True
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != CACHE_VERSION:
+                return
+            for key, ranges in data.get("calendars", {}).items():
+                self.calendars[key] = [
+                    {
+                        "start": parse_time(r["start"]),
+                        "end": parse_time(r["end"]),
+                        "fetched_at": r["fetched_at"],
+                        "busy": [(parse_time(s), parse_time(e)) for s, e in r["busy"]]
+                    }
+                    for r in ranges
+                ]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring free/busy cache {self.path}: {e}")
+            self.calendars.clear()
+
+
+FREEBUSY_CACHE = FreeBusyCache() if FREEBUSY_CACHE_PATH else None
+
+
+def main():
+    # round trips against the local fake endpoint: first week, same week again, window grown to two weeks
+    from input import fetch_freebusy_from_api
+
+    now = datetime.now(timezone.utc)
+    busy = [(now + timedelta(days=d, hours=h), now + timedelta(days=d, hours=h + 1)) for d in range(21) for h in (2, 5)]
+    service = FakeFreeBusyService({"primary": busy})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = FreeBusyCache(Path(tmp) / "freebusy_cache.json")
+        for days_ahead in (7, 7, 14):
+            before = len(service.requests)
+            found = fetch_freebusy_from_api(["primary"], days_ahead, service=service, cache=cache, namespace="fake")
+            fetched = [f"{body['timeMin']} - {body['timeMax']}" for body in service.requests[before:]]
+            print(f"{days_ahead} days: {len(found)} busy intervals, fetched {', '.join(fetched) or 'nothing'}")
+
+        # a new process reads the file instead of calling the endpoint
+        reloaded = FreeBusyCache(cache.path)
+        before = len(service.requests)
+        found = fetch_freebusy_from_api(["primary"], 14, service=service, cache=reloaded, namespace="fake")
+        print(f"reloaded, 14 days: {len(found)} busy intervals, {len(service.requests) - before} requests")
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,70 @@
 import os
-import re
 import json
-import string
+import heapq
+import struct
+import shutil
+import hashlib
+import argparse
+from array import array
 from pathlib import Path
-from nltk.stem import PorterStemmer
-
-class Posting:
-    def __init__(self, room_doc_id: int):
-        self.room_doc_id = room_doc_id
-        self.term_freq = 1 # binary presence
-        self.term_weight = 1.0
-
-    def post_report(self):
-        return {
-            "room_doc_id": self.room_doc_id,
-            "term frequency": self.term_freq,
-            "term weight (importance)" : self.term_weight
-        }
-    
-# tokenization -> not really using weights
-stemmer = PorterStemmer()
-TOKEN_RE = re.compile(r"\b[a-zA-Z0-9]+\b")
-
-def tokenize_and_stem(text):
-    # return set of stems for this test -> binary presence
-    if not isinstance(text, str) or not text.strip():
-        return set()
-        
-    stems = set()
-    for tok in TOKEN_RE.findall(text.lower()):
-        stems.add(stemmer.stem(tok))
-    return stems
-
-# make partitions for easy indexing
-letters = list(string.ascii_lowercase)
-PARTITIONS = (
-    ["other"]
-    + letters
-    + [a + b for a in letters for b in letters]
-    + [a + b + c for a in letters for b in letters for c in letters]
-)
-
-def get_partition(token):
-    if not token:
-        return "other"
-    token = token.lower()
-
-    if token[0] not in string.ascii_lowercase:
-        return "other"
-    
-    if len(token) == 1 or token[1] not in string.ascii_letters:
-        return token[0]
-    
-    if len(token) == 2 or token[2] not in string.ascii_letters:
-        return token[:2]
-    
-    return token[:3]
+from bisect import bisect_right
+from postings import POSTINGS_SUFFIX, PostingsReader, PostingsWriter, write_postings
+from availability import AvailabilityStore, free_runs, write_availability_store
+from docstore import SPACES_NAME, load_spaces
+from tokenizer import STEM_CACHE, STEM_CACHE_NAME, load_stem_cache, save_stem_cache, tokenize_and_stem
+from segment import (current_segment_dir, new_segment_dir, publish_segment, read_segment_header,
+                     verify_segment, write_segment_header, add_segment_files)
+
+# tokenization -> not really using weights, stemming is memoized in tokenizer.py
+def field_term(field, stem):
+    return f"{field}:{stem}"
+
+# duration buckets: "duration:60" -> the room has a free run of at least 60 minutes that day
+# lets retrieval drop rooms on availability before scoring text (see query.FILTER)
+# bucket postings are read off the availability store's earliest start tables, not the text index:
+# a slots-only refresh keeps them current and slots stay out of the static hash
+DURATION_BUCKETS = (15, 30, 45, 60, 90, 120, 180, 240, 360, 480)
+
+def duration_bucket(duration_minutes, buckets=DURATION_BUCKETS):
+    # largest bucket <= duration, every room that fits the duration is in it
+    fitting = [b for b in buckets if b <= duration_minutes]
+    return fitting[-1] if fitting else None
+
+# partitions: the sorted term space is cut into ranges of roughly equal postings bytes
+# a small routing table (first term of every partition) sends a term to its partition
+TARGET_PARTITION_BYTES = 256 * 1024
+ROUTING_NAME = "partitions.tsv"
+
+def partition_name(i):
+    return f"p{i:05d}"
+
+def load_partition_routes(out_folder):
+    # returns (first terms, partition names), both sorted by term
+    path = Path(out_folder) / ROUTING_NAME
+    first_terms = []
+    parts = []
+    if not path.exists():
+        return first_terms, parts
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            part, first_term = line.rstrip("\n").split("\t", 1)
+            parts.append(part)
+            first_terms.append(first_term)
+    return first_terms, parts
+
+def save_partition_routes(out_folder, routes):
+    path = Path(out_folder) / ROUTING_NAME
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for part, first_term in routes:
+            f.write(f"{part}\t{first_term}\n")
+    os.replace(tmp_path, path)
+
+def route_term(first_terms, parts, term):
+    # binary search: last partition starting at or before the term
+    i = bisect_right(first_terms, term) - 1
+    return parts[i] if i >= 0 else None
 
 # get one doc per room
 def extract_room_docs(file_path):
@@ -63,6 +72,7 @@ def extract_room_docs(file_path):
     returns {
         uid : identifier
         terms: set(stems)
+        free_runs: [(start slot, length)]
         store : metadata (slots bitset)
     }
     '''
@@ -105,12 +115,30 @@ def extract_room_docs(file_path):
         ]).strip()
 
         terms = tokenize_and_stem(searchable_text)
+        doc_len = len(terms)
+
+        # maximal free runs, the availability store turns them into an earliest start table
+        runs = free_runs(bitset) if isinstance(bitset, str) else []
+
+        # field scoped terms -> "feature:whiteboard", "space:langson", ...
+        field_text = {
+            "space": [space_name, space_id],
+            "room": [room_name, room_id],
+            "feature": features,
+            "capacity": [capacity],
+            "date": [day]
+        }
+        for field, values in field_text.items():
+            for stem in tokenize_and_stem(" ".join(str(v) for v in values)):
+                terms.add(field_term(field, stem))
 
         docs.append({
             "uid": uid,
             "terms": terms,
+            "free_runs": runs,
             "store": {
                 "uid" : uid,
+                "doc_len": doc_len,
                 "space": {
                     "id": space_id,
                     "name" : space_name,
@@ -130,45 +158,182 @@ def extract_room_docs(file_path):
                 }
             }
         })
+        if room.get("location"):
+            # per room coordinates (large spaces), retrieval prefers them over the space location
+            docs[-1]["store"]["room"]["location"] = room["location"]
     
     return docs
 
 # index writing
-def flush_partial_index(partial_index, out_folder, run_id):
-    out_folder = Path(out_folder)
-
-    for part, index in partial_index.items():
-        if not index:
-            continue
-        
-        posting_obj_map = {}
-        for term, postings_dict in index.items():
-            sorted_postings = sorted(postings_dict.values(), key=lambda p: p.room_doc_id)
-            posting_obj_map[term] = [p.post_report() for p in sorted_postings]
-        
-        posting_obj_map = dict(sorted(posting_obj_map.items()))
-        out_path = out_folder / f"inverted_index_{part}_run{run_id}.json"
-        with open(out_path, 'w', encoding="utf-8") as f:
-            json.dump(posting_obj_map, f, ensure_ascii=False)
+def run_path(out_folder, run_id):
+    return Path(out_folder) / f"inverted_index_run{run_id}{POSTINGS_SUFFIX}"
+
+def partition_path(out_folder, part):
+    return Path(out_folder) / f"inverted_index_{part}{POSTINGS_SUFFIX}"
+
+def existing_partitions(out_folder):
+    return load_partition_routes(out_folder)[1]
+
+# manifest: source file -> mtime, content hash and the room doc ids it produced
+MANIFEST_NAME = "index_manifest.json"
+AVAILABILITY_NAME = "roomavail.bin"
+DOCMAP_NAME = "roomdocmap.tsv"
+DOCSTORE_NAME = "roomdocstore.jsonl"
+
+# docstore offsets: byte offset of every docstore line, little endian uint64, doc id = position
+DOCSTORE_OFFSETS_NAME = "roomdocstore.off"
+
+def append_docstore_offsets(out_folder, offsets):
+    with open(Path(out_folder) / DOCSTORE_OFFSETS_NAME, "ab") as f:
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+
+# room columns: the per room numbers retrieval filters and ranks on, so startup reads them
+# without decoding the docstore (see roomtable.py)
+#   [header]   magic, version
+#   [records]  one per room doc id: capacity, lat, lon, doc_len (float64, nan = unknown),
+#              opening minute, slot minutes, space code (int32)
+# space codes number the distinct space ids in the order the spaces table first lists them
+ROOM_COLUMNS_NAME = "roomcolumns.bin"
+ROOM_COLUMNS_MAGIC = b"SBRC"
+ROOM_COLUMNS_VERSION = 1
+ROOM_COLUMNS_HEADER = struct.Struct("<4sH")
+ROOM_COLUMN_FIELDS = [("capacity", "d"), ("lat", "d"), ("lon", "d"), ("doc_len", "d"),
+                      ("day_start", "i"), ("slot_minutes", "i"), ("space_code", "i")]
+ROOM_COLUMNS = struct.Struct("<" + "".join(kind for _, kind in ROOM_COLUMN_FIELDS))
+
+def to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+def hhmm_to_minutes(hhmm):
+    h, m = map(int, hhmm.split(":"))
+    return h * 60 + m
+
+def room_columns(store):
+    # column values of a docstore record, the space id stands in for its code
+    space = store["space"]
+    room = store["room"]
+    # rooms with their own coordinates use them, the rest sit at the space location
+    loc = room.get("location") or space.get("location") or {}
+    hours = space.get("hours") or {}
+    return (to_number(room.get("capacity")), to_number(loc.get("lat")), to_number(loc.get("lon")),
+            to_number(store.get("doc_len")), hhmm_to_minutes(hours.get("start", "00:00")),
+            space.get("slot_minutes") or 30, space["id"])
+
+def pack_room_columns(columns, space_codes):
+    # space_codes: space id -> code, new ids are numbered in first seen order
+    code = space_codes.setdefault(columns[-1], len(space_codes))
+    return ROOM_COLUMNS.pack(*columns[:-1], code)
+
+def append_room_columns(out_folder, records):
+    path = Path(out_folder) / ROOM_COLUMNS_NAME
+    with open(path, "ab") as f:
+        if f.tell() == 0:
+            f.write(ROOM_COLUMNS_HEADER.pack(ROOM_COLUMNS_MAGIC, ROOM_COLUMNS_VERSION))
+        f.write(b"".join(records))
+
+# spaces table: the space block (hours, timezone, location, ...) is stored once per distinct
+# content and docstore records point at it by ref (see docstore.py)
+def space_ref(space):
+    digest = hashlib.sha1(json.dumps(space, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+    return f"{space.get('id')}@{digest}"
+
+def docstore_line(store, spaces):
+    # new spaces are collected in spaces (ref -> space) in first seen order
+    ref = space_ref(store["space"])
+    if ref not in spaces:
+        spaces[ref] = store["space"]
+    record = {("space_ref" if k == "space" else k): (ref if k == "space" else v) for k, v in store.items()}
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+def append_spaces(out_folder, spaces):
+    with open(Path(out_folder) / SPACES_NAME, "a", encoding="utf-8") as f:
+        for ref, space in spaces.items():
+            f.write(json.dumps({"ref": ref, "space": space}, ensure_ascii=False) + "\n")
+
+# availability only refreshes: the last REFRESH_LOG_SIZE ones are listed in the manifest
+# as [generation, refreshed doc ids], older readers reload fully
+REFRESH_LOG_SIZE = 16
+
+def load_manifest(out_folder):
+    path = Path(out_folder) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(out_folder, manifest):
+    path = Path(out_folder) / MANIFEST_NAME
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def file_sha1(file_path):
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def static_sha1(room_docs):
+    # hash of everything except availability -> tells slot-only changes apart
+    h = hashlib.sha1()
+    for d in room_docs:
+        store = dict(d["store"], room={k: v for k, v in d["store"]["room"].items() if k != "slots_bitset"})
+        h.update(json.dumps([sorted(d["terms"]), store], sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+def file_entry(file_path, room_docs, doc_ids):
+    return {
+        "mtime_ns": file_path.stat().st_mtime_ns,
+        "sha1": file_sha1(file_path),
+        "static_sha1": static_sha1(room_docs),
+        "doc_ids": doc_ids
+    }
 
-def make_partial_inverted_indexes(folderpath, out_folder, batch_size=10000):
+def flush_partial_index(partial_index, out_folder, run_id):
+    # one run file per flush, sorted by term then doc id so runs can be stream merged
+    # binary presence -> only the sorted doc ids are written
+    write_postings(run_path(out_folder, run_id), partial_index)
+
+def add_postings(index, terms, room_doc_id):
+    # index: {term: array('I')}, doc ids arrive in increasing order so every array stays sorted
+    # 4 bytes per posting instead of a python object per posting
+    for term in terms:
+        postings = index.get(term)
+        if postings is None:
+            postings = index[term] = array("I")
+        postings.append(room_doc_id)
+
+def make_partial_inverted_indexes(folderpath, out_folder, batch_size=10000, generation=None):
     #do partial run (probably wont see it but would help for larger expansion)
-    partial_index = {p: {} for p in PARTITIONS}
+    partial_index = {}
     room_doc_id = 0
     rooms_in_batch =  0
     run_id = 0
+    manifest_files = {}
 
     folder = Path(folderpath)
     out_folder = Path(out_folder)
     out_folder.mkdir(parents=True, exist_ok=True)
 
-    docmap_path = out_folder / "roomdocmap.tsv"
-    docstore_path = out_folder / "roomdocstore.jsonl"
+    docmap_path = out_folder / DOCMAP_NAME
+    docstore_path = out_folder / DOCSTORE_NAME
+    bitsets = []
+    room_runs = []
+    offsets = []
+    spaces = {}
+    columns = []
+    space_codes = {}
+    docstore_bytes = 0
 
     print("Creating Study Spot (binary) Index...")
 
     with open(docmap_path, "w", encoding="utf-8") as docmap, \
-        open(docstore_path, "w", encoding="utf-8") as docstore:
+        open(docstore_path, "wb") as docstore:
         
             for root, _, files in os.walk(folder):
                 for file_name in files:
@@ -183,6 +348,9 @@ def make_partial_inverted_indexes(folderpath, out_folder, batch_size=10000):
                         print(f"Skipping {file_path} (parse error): {e}")
                         continue
 
+                    rel_path = file_path.relative_to(folder).as_posix()
+                    manifest_files[rel_path] = file_entry(file_path, room_docs, list(range(room_doc_id, room_doc_id + len(room_docs))))
+
                     for d in room_docs:
                         uid = d["uid"]
                         terms = d["terms"]
@@ -191,62 +359,507 @@ def make_partial_inverted_indexes(folderpath, out_folder, batch_size=10000):
                         docmap.write(f"{room_doc_id}\t{uid}\n")
 
                         # docstore: meta data for filtering
-                        docstore.write(json.dumps(d["store"], ensure_ascii=False) + "\n")
+                        line = docstore_line(d["store"], spaces)
+                        offsets.append(docstore_bytes)
+                        docstore.write(line)
+                        docstore_bytes += len(line)
+                        columns.append(pack_room_columns(room_columns(d["store"]), space_codes))
 
-                        for term in terms:
-                            part = get_partition(term)
-                            index = partial_index[part]
+                        # availability: hot store, updated in place later on
+                        bitsets.append(d["store"]["room"]["slots_bitset"])
+                        room_runs.append(d["free_runs"])
 
-                            if term not in index:
-                                index[term] = {}
-
-                            postings_for_term = index[term]
-                            if room_doc_id not in postings_for_term:
-                                postings_for_term[room_doc_id] = Posting(room_doc_id)
+                        add_postings(partial_index, terms, room_doc_id)
 
                         room_doc_id += 1
                         rooms_in_batch += 1
 
                         if rooms_in_batch >= batch_size:
                             flush_partial_index(partial_index, out_folder, run_id)
-                            partial_index = {p: {} for p in PARTITIONS}
+                            partial_index = {}
                             rooms_in_batch = 0
                             run_id += 1
     
-    if any(partial_index[p] for p in PARTITIONS):
+    if partial_index:
         flush_partial_index(partial_index, out_folder, run_id)
         run_id += 1
 
+    write_availability_store(out_folder / AVAILABILITY_NAME, bitsets, runs=room_runs)
+    for name in (DOCSTORE_OFFSETS_NAME, SPACES_NAME, ROOM_COLUMNS_NAME):
+        (out_folder / name).unlink(missing_ok=True)
+    append_docstore_offsets(out_folder, offsets)
+    append_spaces(out_folder, spaces)
+    append_room_columns(out_folder, columns)
+
+    # generation: bumped on every index change, retrieval drops cached results on a new one
+    if generation is None:
+        generation = (load_manifest(out_folder) or {}).get("generation", 0) + 1
+    save_manifest(out_folder, {
+        "generation": generation,
+        "next_doc_id": room_doc_id,
+        "num_runs": run_id,
+        "delta_runs": [],
+        "deleted": [],
+        "files": manifest_files
+    })
+
     print(f"Indexing Done, Created {run_id} partial runs.")
     return room_doc_id, run_id
 
-def merge_partial_indexes(out_folder, num_runs):
+# parallel indexing: workers parse + stem contiguous shards of the file list
+# and write runs / a docstore chunk with local doc ids (0 = first room of the shard)
+# the coordinator assigns global ids as shard base + local id, so ids match a serial build
+SHARDS_PER_WORKER = 4
+
+def list_source_files(folder):
+    # same order as the serial walk
+    paths = []
+    for root, _, files in os.walk(folder):
+        for file_name in files:
+            if file_name.lower().endswith(".json"):
+                paths.append(Path(root) / file_name)
+    return paths
+
+def make_shards(paths, num_shards):
+    # contiguous slices of roughly equal bytes
+    sizes = [p.stat().st_size for p in paths]
+    target = max(1, sum(sizes) // max(1, num_shards))
+    shards = []
+    shard = []
+    shard_bytes = 0
+    for path, size in zip(paths, sizes):
+        shard.append(path)
+        shard_bytes += size
+        if shard_bytes >= target:
+            shards.append(shard)
+            shard = []
+            shard_bytes = 0
+    if shard:
+        shards.append(shard)
+    return shards
+
+def shard_run_path(out_folder, shard_id, run_id):
+    return run_path(out_folder, f"s{shard_id:05d}_{run_id}")
+
+def index_shard(task):
+    # worker side, returns everything the coordinator needs to place the shard
+    shard_id, folder, paths, out_folder, batch_size = task
+    stem_hits, stem_misses = STEM_CACHE.hits, STEM_CACHE.misses
+    partial_index = {}
+    local_id = 0
+    rooms_in_batch = 0
+    runs = []
+    files = []
+    uids = []
+    bitsets = []
+    room_runs = []
+    offsets = []
+    spaces = {}
+    columns = []
+    docstore_bytes = 0
+
+    chunk_path = Path(out_folder) / f"{DOCSTORE_NAME}.s{shard_id:05d}"
+    with open(chunk_path, "wb") as docstore:
+        for file_path in paths:
+            try:
+                room_docs = extract_room_docs(file_path)
+            except Exception as e:
+                print(f"Skipping {file_path} (parse error): {e}")
+                continue
+
+            rel_path = file_path.relative_to(folder).as_posix()
+            files.append((rel_path, file_entry(file_path, room_docs, list(range(local_id, local_id + len(room_docs))))))
+
+            for d in room_docs:
+                line = docstore_line(d["store"], spaces)
+                offsets.append(docstore_bytes)
+                docstore.write(line)
+                docstore_bytes += len(line)
+                uids.append(d["uid"])
+                columns.append(room_columns(d["store"]))
+                bitsets.append(d["store"]["room"]["slots_bitset"])
+                room_runs.append(d["free_runs"])
+
+                add_postings(partial_index, d["terms"], local_id)
+
+                local_id += 1
+                rooms_in_batch += 1
+
+                if rooms_in_batch >= batch_size:
+                    runs.append(shard_run_path(out_folder, shard_id, len(runs)))
+                    write_postings(runs[-1], partial_index)
+                    partial_index = {}
+                    rooms_in_batch = 0
+
+    if partial_index:
+        runs.append(shard_run_path(out_folder, shard_id, len(runs)))
+        write_postings(runs[-1], partial_index)
+
+    return {
+        "num_docs": local_id,
+        "runs": runs,
+        "files": files,
+        "uids": uids,
+        "bitsets": bitsets,
+        "free_runs": room_runs,
+        "offsets": offsets,
+        "spaces": spaces,
+        "columns": columns,
+        "docstore_chunk": chunk_path,
+        "stems": STEM_CACHE.entries,
+        "stem_hits": STEM_CACHE.hits - stem_hits,
+        "stem_misses": STEM_CACHE.misses - stem_misses
+    }
+
+def make_parallel_inverted_indexes(folderpath, out_folder, batch_size=10000, workers=None, generation=None):
+    '''
+    returns (number of rooms, [(run path, doc id base)]) for merge_runs
+    '''
+    folder = Path(folderpath)
     out_folder = Path(out_folder)
+    out_folder.mkdir(parents=True, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
 
-    for part in PARTITIONS:
-        merged = {}
+    shards = make_shards(list_source_files(folder), workers * SHARDS_PER_WORKER)
+    tasks = [(shard_id, folder, paths, out_folder, batch_size) for shard_id, paths in enumerate(shards)]
 
-        for run_id in range(num_runs):
-            path = out_folder / f"inverted_index_{part}_run{run_id}.json"
-            if not path.exists():
-                continue
+    print(f"Creating Study Spot (binary) Index with {workers} workers, {len(shards)} shards...")
+    # only index builds need worker processes, query side imports of this module skip multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
 
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+    room_doc_id = 0
+    runs = []
+    manifest_files = {}
+    bitsets = []
+    room_runs = []
+    offsets = []
+    spaces = {}
+    columns = []
+    space_codes = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+        open(out_folder / DOCMAP_NAME, "w", encoding="utf-8") as docmap, \
+        open(out_folder / DOCSTORE_NAME, "wb") as docstore:
+
+            # results come back in shard order, each shard is placed right after the previous one
+            for result in pool.map(index_shard, tasks):
+                base = room_doc_id
+
+                for i, uid in enumerate(result["uids"]):
+                    docmap.write(f"{base + i}\t{uid}\n")
+
+                docstore_base = docstore.tell()
+                with open(result["docstore_chunk"], "rb") as chunk:
+                    shutil.copyfileobj(chunk, docstore)
+                result["docstore_chunk"].unlink()
+                offsets.extend(docstore_base + off for off in result["offsets"])
+                for ref, space in result["spaces"].items():
+                    spaces.setdefault(ref, space)
+                # space codes are global, numbered in shard order like a serial build
+                columns.extend(pack_room_columns(row, space_codes) for row in result["columns"])
+
+                for rel_path, entry in result["files"]:
+                    entry["doc_ids"] = [base + d for d in entry["doc_ids"]]
+                    manifest_files[rel_path] = entry
+
+                # worker memo tables -> one table persisted with the segment
+                STEM_CACHE.update(result["stems"])
+                STEM_CACHE.hits += result["stem_hits"]
+                STEM_CACHE.misses += result["stem_misses"]
+
+                bitsets.extend(result["bitsets"])
+                room_runs.extend(result["free_runs"])
+                runs.extend((path, base) for path in result["runs"])
+                room_doc_id += result["num_docs"]
+
+    write_availability_store(out_folder / AVAILABILITY_NAME, bitsets, runs=room_runs)
+    for name in (DOCSTORE_OFFSETS_NAME, SPACES_NAME, ROOM_COLUMNS_NAME):
+        (out_folder / name).unlink(missing_ok=True)
+    append_docstore_offsets(out_folder, offsets)
+    append_spaces(out_folder, spaces)
+    append_room_columns(out_folder, columns)
+
+    if generation is None:
+        generation = (load_manifest(out_folder) or {}).get("generation", 0) + 1
+    save_manifest(out_folder, {
+        "generation": generation,
+        "next_doc_id": room_doc_id,
+        "num_runs": 0,
+        "delta_runs": [],
+        "deleted": [],
+        "files": manifest_files
+    })
+
+    print(f"Indexing Done, Created {len(runs)} partial runs.")
+    return room_doc_id, runs
+
+def update_index(folderpath, out_folder):
+    # incremental mode: only re-extract new / changed files and write their rooms as a delta run
+    # rooms of changed or removed files are tombstoned until merge_delta folds everything together
+    # files where only the slots changed are patched in the availability store instead
+    # out_folder is the live segment: everything is appended and the manifest is replaced last,
+    # so a reader never sees a delta run or docstore line the manifest doesn't know about yet
+    folder = Path(folderpath)
+    out_folder = Path(out_folder)
 
-            for term, postings in data.items():
-                merged.setdefault(term, []).extend(postings)
+    manifest = load_manifest(out_folder)
+    if manifest is None:
+        print("No index manifest found, run a full index first.")
+        return None
+
+    load_stem_cache(out_folder)
+    files = manifest["files"]
+    deleted = set(manifest["deleted"])
+    room_doc_id = manifest["next_doc_id"]
+    delta_index = {}
+    new_bitsets = []
+    new_runs = []
+    seen = set()
+    num_changed = 0
+    refreshed = []
+
+    docmap_path = out_folder / DOCMAP_NAME
+    docstore_path = out_folder / DOCSTORE_NAME
+    docstore_bytes = docstore_path.stat().st_size
+    offsets = []
+    known_spaces = load_spaces(out_folder / SPACES_NAME)
+    spaces = {}
+    columns = []
+    space_codes = {}
+    for space in known_spaces.values():
+        space_codes.setdefault(space["id"], len(space_codes))
+
+    print("Updating Study Spot (binary) Index...")
+
+    # appending keeps docstore line number == room doc id
+    with open(docmap_path, "a", encoding="utf-8") as docmap, \
+        open(docstore_path, "ab") as docstore, \
+        AvailabilityStore(out_folder / AVAILABILITY_NAME, writable=True) as avail:
+
+            for root, _, names in os.walk(folder):
+                for file_name in names:
+                    if not file_name.lower().endswith(".json"):
+                        continue
 
-        if not merged:
-            continue
+                    file_path = Path(root) / file_name
+                    rel_path = file_path.relative_to(folder).as_posix()
+                    seen.add(rel_path)
 
-        for term in merged:
-            merged[term].sort(key=lambda p: p["room_doc_id"])
+                    entry = files.get(rel_path)
+                    mtime_ns = file_path.stat().st_mtime_ns
+                    if entry and entry["mtime_ns"] == mtime_ns:
+                        continue
+
+                    sha1 = file_sha1(file_path)
+                    if entry and entry["sha1"] == sha1:
+                        entry["mtime_ns"] = mtime_ns
+                        continue
 
-        merged = dict(sorted(merged.items()))
-        final_path = out_folder / f"inverted_index_{part}.json"
-        with open (final_path, "w", encoding="utf-8") as f:
-            json.dump(merged, f, ensure_ascii=False)
+                    try:
+                        room_docs = extract_room_docs(file_path)
+                    except Exception as e:
+                        print(f"Skipping {file_path} (parse error): {e}")
+                        continue
+
+                    file_static_sha1 = static_sha1(room_docs)
+                    if entry and entry["static_sha1"] == file_static_sha1:
+                        # availability only change, the text index stays untouched
+                        for doc_id, d in zip(entry["doc_ids"], room_docs):
+                            avail.set_bitset(doc_id, d["store"]["room"]["slots_bitset"], d["free_runs"])
+                            refreshed.append(doc_id)
+                        entry.update(mtime_ns=mtime_ns, sha1=sha1)
+                        continue
+
+                    if entry:
+                        deleted.update(entry["doc_ids"])
+
+                    doc_ids = []
+                    for d in room_docs:
+                        docmap.write(f"{room_doc_id}\t{d['uid']}\n")
+                        line = docstore_line(d["store"], spaces)
+                        offsets.append(docstore_bytes)
+                        docstore.write(line)
+                        docstore_bytes += len(line)
+                        columns.append(pack_room_columns(room_columns(d["store"]), space_codes))
+                        new_bitsets.append(d["store"]["room"]["slots_bitset"])
+                        new_runs.append(d["free_runs"])
+
+                        add_postings(delta_index, d["terms"], room_doc_id)
+
+                        doc_ids.append(room_doc_id)
+                        room_doc_id += 1
+
+                    files[rel_path] = {"mtime_ns": mtime_ns, "sha1": sha1, "static_sha1": file_static_sha1, "doc_ids": doc_ids}
+                    num_changed += 1
+
+            if new_bitsets:
+                avail.append(new_bitsets, new_runs)
+    if offsets:
+        append_docstore_offsets(out_folder, offsets)
+    if columns and (out_folder / ROOM_COLUMNS_NAME).exists():
+        # indexes built without the file keep reading the docstore instead
+        append_room_columns(out_folder, columns)
+    new_spaces = {ref: space for ref, space in spaces.items() if ref not in known_spaces}
+    if new_spaces:
+        append_spaces(out_folder, new_spaces)
+
+    for rel_path in list(files):
+        if rel_path not in seen:
+            deleted.update(files.pop(rel_path)["doc_ids"])
+            num_changed += 1
+
+    new_files = []
+    if delta_index:
+        run_id = manifest["num_runs"]
+        write_postings(run_path(out_folder, run_id), delta_index)
+        manifest["num_runs"] = run_id + 1
+        manifest["delta_runs"].append(run_id)
+        new_files.append(run_path(out_folder, run_id).name)
+
+    num_added = room_doc_id - manifest["next_doc_id"]
+    if num_changed or refreshed:
+        manifest["generation"] = manifest.get("generation", 0) + 1
+        # stems of the new text, the next process starts with them (checksummed again below)
+        save_stem_cache(out_folder)
+        new_files.append(STEM_CACHE_NAME)
+    if refreshed:
+        # readers catching up on slots only generations patch just these rooms (see retrieval.index_generation)
+        log = manifest.get("refreshed", []) + [[manifest["generation"], sorted(refreshed)]]
+        manifest["refreshed"] = log[-REFRESH_LOG_SIZE:]
+    manifest["next_doc_id"] = room_doc_id
+    manifest["deleted"] = sorted(deleted)
+    if read_segment_header(out_folder) is not None:
+        add_segment_files(out_folder, new_files, manifest["generation"])
+    save_manifest(out_folder, manifest)
+
+    print(f"Update Done, {num_changed} changed files, {num_added} rooms added, "
+          f"{len(deleted)} rooms pending delete, {len(refreshed)} rooms availability refreshed.")
+    return room_doc_id, num_changed
+
+def iter_run(path, run_id, base=0):
+    # base: shard runs hold local doc ids, shifted to global ones while merging
+    with PostingsReader(path) as reader:
+        for term, doc_ids in reader.items():
+            yield term, run_id, array("I", [d + base for d in doc_ids]) if base else doc_ids
+
+def merge_sources(out_folder, sources, deleted=None, target_bytes=TARGET_PARTITION_BYTES):
+    # k-way heap merge, one sequential pass per source
+    # sources hold increasing doc id ranges (by rank) so postings of equal terms just get concatenated
+    # a new partition starts once the current one holds target_bytes
+    # partitions are written next to the old ones and swapped in once every source is consumed
+    out_folder = Path(out_folder)
+    old_parts = existing_partitions(out_folder)
+
+    writer = None
+    routes = []
+
+    def flush_term(term, doc_ids):
+        nonlocal writer
+        if deleted:
+            doc_ids = array("I", [d for d in doc_ids if d not in deleted])
+            if not doc_ids:
+                return
+
+        if writer is None or writer.size >= target_bytes:
+            if writer is not None:
+                writer.close()
+            part = partition_name(len(routes))
+            writer = PostingsWriter(partition_path(out_folder, part).with_suffix(".tmp"))
+            routes.append((part, term))
+        writer.add(term, doc_ids)
+
+    term = None
+    doc_ids = array("I")
+    for next_term, _, next_doc_ids in heapq.merge(*sources, key=lambda x: (x[0], x[1])):
+        if next_term != term:
+            if term is not None:
+                flush_term(term, doc_ids)
+            term = next_term
+            doc_ids = array("I")
+        doc_ids.extend(next_doc_ids)
+
+    if term is not None:
+        flush_term(term, doc_ids)
+    if writer is not None:
+        writer.close()
+
+    new_parts = {part for part, _ in routes}
+    for part in old_parts:
+        if part not in new_parts:
+            partition_path(out_folder, part).unlink()
+    for part in new_parts:
+        final_path = partition_path(out_folder, part)
+        os.replace(final_path.with_suffix(".tmp"), final_path)
+    save_partition_routes(out_folder, routes)
+
+def merge_runs(out_folder, runs):
+    # runs: [(path, doc id base)] in doc id order
+    runs = [(path, base) for path, base in runs if path.exists()]
+    merge_sources(out_folder, [iter_run(path, rank, base) for rank, (path, base) in enumerate(runs)])
+
+    # runs are only build scratch once the partitions exist
+    for path, _ in runs:
+        path.unlink()
+
+def merge_partial_indexes(out_folder, num_runs):
+    merge_runs(out_folder, [(run_path(out_folder, run_id), 0) for run_id in range(num_runs)])
+
+def build_index(folderpath, index_root, batch_size=10000, workers=1):
+    # full build into a fresh segment, published once it is complete
+    previous = load_manifest(current_segment_dir(index_root))
+    seg_dir = new_segment_dir(index_root)
+
+    generation = (previous or {}).get("generation", 0) + 1
+    if workers > 1:
+        num_docs, runs = make_parallel_inverted_indexes(folderpath, seg_dir, batch_size, workers, generation)
+        merge_runs(seg_dir, runs)
+    else:
+        num_docs, num_runs = make_partial_inverted_indexes(folderpath, seg_dir, batch_size, generation)
+        merge_partial_indexes(seg_dir, num_runs)
+    index_analytics(seg_dir, num_docs)
+    save_stem_cache(seg_dir)
+    print(f"Stem cache: {len(STEM_CACHE.entries)} tokens, hit rate {STEM_CACHE.hit_rate():.1%}")
+
+    write_segment_header(seg_dir, generation, num_docs=num_docs)
+    seg_dir = publish_segment(index_root, seg_dir)
+    print(f"Published segment {seg_dir.name} (generation {generation}).")
+    return num_docs
+
+def merge_delta(index_root):
+    # fold pending delta runs and deletes of the live segment into a new segment
+    src_dir = current_segment_dir(index_root)
+
+    manifest = load_manifest(src_dir)
+    if manifest is None or not (manifest["delta_runs"] or manifest["deleted"]):
+        return
+
+    seg_dir = new_segment_dir(index_root)
+
+    # main partitions hold the oldest doc ids -> rank 0, deltas follow in creation order
+    sources = [iter_run(partition_path(src_dir, part), 0) for part in existing_partitions(src_dir)]
+    for rank, run_id in enumerate(manifest["delta_runs"], 1):
+        sources.append(iter_run(run_path(src_dir, run_id), rank))
+
+    merge_sources(seg_dir, sources, deleted=set(manifest["deleted"]))
+
+    # doc ids are unchanged, the doc side of the index carries over as is
+    for name in (DOCMAP_NAME, DOCSTORE_NAME, DOCSTORE_OFFSETS_NAME, SPACES_NAME, AVAILABILITY_NAME, ROOM_COLUMNS_NAME):
+        if (src_dir / name).exists():
+            shutil.copyfile(src_dir / name, seg_dir / name)
+    load_stem_cache(src_dir)
+    save_stem_cache(seg_dir)
+
+    manifest["delta_runs"] = []
+    manifest["deleted"] = []
+    manifest["refreshed"] = []
+    manifest["generation"] = manifest.get("generation", 0) + 1
+    save_manifest(seg_dir, manifest)
+
+    num_docs = sum(len(entry["doc_ids"]) for entry in manifest["files"].values())
+    index_analytics(seg_dir, num_docs)
+    write_segment_header(seg_dir, manifest["generation"], num_docs=num_docs)
+    seg_dir = publish_segment(index_root, seg_dir)
+    print(f"Delta merge Done, published segment {seg_dir.name}.")
 
 def index_analytics(out_folder, num_rooms):
     out_folder = Path(out_folder)
@@ -254,15 +867,15 @@ def index_analytics(out_folder, num_rooms):
     num_unique_tokens = 0
     total_bytes = 0
 
-    for part in PARTITIONS:
-        index_path = out_folder / f"inverted_index_{part}.json"
+    for part in existing_partitions(out_folder):
+        index_path = partition_path(out_folder, part)
         if index_path.exists():
-            with open(index_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            num_unique_tokens += len(data)
+            with PostingsReader(index_path) as reader:
+                num_unique_tokens += len(reader)
             total_bytes += index_path.stat().st_size
 
-    for extra in ["docmap.tsv", "docstore.jsonl"]:
+    for extra in [ROUTING_NAME, DOCMAP_NAME, DOCSTORE_NAME, DOCSTORE_OFFSETS_NAME, SPACES_NAME, AVAILABILITY_NAME,
+                  ROOM_COLUMNS_NAME]:
         p = out_folder / extra
         if p.exists():
             total_bytes += p.stat().st_size
@@ -274,7 +887,7 @@ def index_analytics(out_folder, num_rooms):
         f.write(
             f"Number of Indexed Rooms: {num_rooms}\n"
             f"Number of Unique tokens: {num_unique_tokens}\n"
-            f"Index size on disk (final index + docmap + docstore): {total_kb} KB\n"
+            f"Index size on disk (partitions + docmap + docstore + availability): {total_kb} KB\n"
         )
 
 
@@ -284,9 +897,30 @@ def main():
 
     batch_size = 10000
 
-    num_docs, num_runs = make_partial_inverted_indexes(input_folder, output_folder, batch_size)
-    merge_partial_indexes(output_folder, num_runs)
-    index_analytics(output_folder, num_docs)
+    parser = argparse.ArgumentParser(description="Build the study spot index")
+    parser.add_argument("--incremental", action="store_true", help="only index new / changed Study Spots files as a delta run")
+    parser.add_argument("--merge-delta", action="store_true", help="fold pending delta runs and deletes into a new segment")
+    parser.add_argument("--verify", action="store_true", help="check the live segment against its checksums")
+    parser.add_argument("--workers", type=int, default=1, help="indexing processes for a full build (0 = one per core)")
+    args = parser.parse_args()
+
+    if args.verify:
+        seg_dir = current_segment_dir(output_folder)
+        problems = verify_segment(seg_dir, full=True)
+        for problem in problems:
+            print(f"{seg_dir.name}: {problem}")
+        print("Segment OK." if not problems else f"{len(problems)} problems found.")
+        return
+
+    if args.incremental or args.merge_delta:
+        if args.incremental:
+            update_index(input_folder, current_segment_dir(output_folder))
+        if args.merge_delta:
+            merge_delta(output_folder)
+        print("DONE.")
+        return
+
+    build_index(input_folder, output_folder, batch_size, args.workers if args.workers > 0 else (os.cpu_count() or 1))
 
     print("DONE.")
 
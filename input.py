@@ -1,13 +1,24 @@
-import json
+import sys
 from datetime import datetime, timedelta
-import pytz
 import os.path
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from busycalendar import BusyCalendar, as_calendar, union_calendars
+from calendars import load_busy_intervals
+from freebusycache import FREEBUSY_CACHE
+
+# the google client libraries and pytz are imported where they are used,
+# a start on the mock schedule never pays for them
+
+# one service per process: token.json is read and the client built on the first request only
+CALENDAR_SERVICE = None
 
 def get_calendar_service():
+    global CALENDAR_SERVICE
+    if CALENDAR_SERVICE is not None:
+        return CALENDAR_SERVICE
+
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
     from google_auth_oauthlib.flow import InstalledAppFlow
     
     SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
@@ -30,116 +41,89 @@ def get_calendar_service():
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
     
-    return build('calendar', 'v3', credentials=creds)
+    # the client refreshes expired access tokens by itself, so the service can be kept
+    CALENDAR_SERVICE = build('calendar', 'v3', credentials=creds)
+    return CALENDAR_SERVICE
+
+def freebusy_request(calendar_ids, time_min, time_max):
+    return {
+        'timeMin': time_min.isoformat().replace('+00:00', 'Z'),
+        'timeMax': time_max.isoformat().replace('+00:00', 'Z'),
+        'timeZone': 'America/Los_Angeles',
+        'items': [{'id': cal_id} for cal_id in calendar_ids]
+    }
 
-def fetch_freebusy_from_api(calendar_ids, days_ahead=7):
+# service: anything shaped like the calendar service (calendars.FakeFreeBusyService), default google
+# cache: a FreeBusyCache, None -> the shared one (freebusycache.FREEBUSY_CACHE), False -> always ask the api
+# namespace keeps answers of different services apart in the cache
+def fetch_freebusy_from_api(calendar_ids, days_ahead=7, service=None, cache=None, namespace="google"):
     try:
-        service = get_calendar_service()
+        import pytz
         
         # set time range
         tz = pytz.timezone("America/Los_Angeles")
         time_min = datetime.now(tz)
         time_max = time_min + timedelta(days=days_ahead)
         
-        # time formats
-        time_min_str = time_min.isoformat().replace('+00:00', 'Z')
-        time_max_str = time_max.isoformat().replace('+00:00', 'Z')
+        # one freebusy query per range the cache does not cover, the service is only built if one is needed
+        def query(ids, start, end):
+            nonlocal service
+            if service is None:
+                service = get_calendar_service()
+            freebusy_response = service.freebusy().query(body=freebusy_request(ids, start, end)).execute()
+            return parse_freebusy_calendars(freebusy_response)
         
-        # prepare request body
-        freebusy_request = {
-            'timeMin': time_min_str,
-            'timeMax': time_max_str,
-            'timeZone': 'America/Los_Angeles',
-            'items': [{'id': cal_id} for cal_id in calendar_ids]
-        }
+        if cache is None:
+            cache = FREEBUSY_CACHE
+        if not cache:
+            return [{'start': start, 'end': end}
+                    for busy in query(calendar_ids, time_min, time_max).values() for start, end in busy]
+        return cache.busy_intervals(calendar_ids, time_min, time_max, query, namespace)
         
-        # execute freebusy query
-        freebusy_response = service.freebusy().query(body=freebusy_request).execute()
-        
-        # parse response
-        busy_intervals = []
-        calendars_data = freebusy_response.get('calendars', {})
-        
-        for cal_id, cal_data in calendars_data.items():
-            for busy_period in cal_data.get('busy', []):
-                start = datetime.fromisoformat(busy_period['start'].replace('Z', '+00:00'))
-                end = datetime.fromisoformat(busy_period['end'].replace('Z', '+00:00'))
-                busy_intervals.append({'start': start, 'end': end})
-        
-        return busy_intervals
-        
-    except HttpError as error:
-        print(f'Google Calendar API error: {error}')
-        return None
     except Exception as e:
-        print(f'Error fetching calendar data: {e}')
+        # HttpError only exists once the google client has been imported
+        errors = sys.modules.get('googleapiclient.errors')
+        if errors is not None and isinstance(e, errors.HttpError):
+            print(f'Google Calendar API error: {e}')
+        else:
+            print(f'Error fetching calendar data: {e}')
         return None
 
 
-# parse mock file
+# busy (start, end) pairs per calendar, calendars the api reports errors for are left out
+def parse_freebusy_calendars(json_response):
+    calendars = {}
+    for calendar_id, data in json_response.get('calendars', {}).items():
+        if data.get('errors'):
+            continue
+        calendars[calendar_id] = [
+            (datetime.fromisoformat(period['start'].replace('Z', '+00:00')),
+             datetime.fromisoformat(period['end'].replace('Z', '+00:00')))
+            for period in data.get('busy', [])
+        ]
+    return calendars
+
+# parse a freebusy response (api or mock file)
 def parse_google_freebusy(json_response):
     busy_intervals = []
-    for calendar_id, data in json_response['calendars'].items():
-        for period in data.get('busy', []):
-            start = datetime.fromisoformat(period['start'].replace('Z', '+00:00'))
-            end = datetime.fromisoformat(period['end'].replace('Z', '+00:00'))
+    for busy in parse_freebusy_calendars(json_response).values():
+        for start, end in busy:
             busy_intervals.append({'start': start, 'end': end})
     return busy_intervals
 
-# compute free time 
+# compute free time
+# busy_intervals: list of {'start', 'end'} or a BusyCalendar, build the calendar once
+# when asking for many windows (it merges and sorts, the list is left untouched)
 def find_free_time(busy_intervals, window_start, window_end, min_duration_minutes=0):
-    if not busy_intervals:
-        total_free = [(window_start, window_end)]
-        if min_duration_minutes > 0:
-            total_free = [(s, e) for s, e in total_free if (e - s).total_seconds() >= min_duration_minutes*60]
-        return total_free
-
-    # sort and merge overlapping busy intervals
-    busy_intervals.sort(key=lambda x: x['start'])
-    merged = []
-    current = busy_intervals[0]
-    for next_interval in busy_intervals[1:]:
-        if next_interval['start'] <= current['end']:
-            current['end'] = max(current['end'], next_interval['end'])
-        else:
-            merged.append(current)
-            current = next_interval
-    merged.append(current)
-
-    # compute free intervals
-    free_intervals = []
-    pointer = window_start
-    for interval in merged:
-        busy_start = max(interval['start'], window_start)
-        busy_end = min(interval['end'], window_end)
-        if pointer < busy_start:
-            free_intervals.append((pointer, busy_start))
-        pointer = max(pointer, busy_end)
-    if pointer < window_end:
-        free_intervals.append((pointer, window_end))
-
-    # filter by minimum duration
-    if min_duration_minutes > 0:
-        free_intervals = [
-            (s, e) for s, e in free_intervals if (e - s).total_seconds() >= min_duration_minutes*60
-        ]
-
-    return free_intervals
+    return as_calendar(busy_intervals).free_windows(window_start, window_end, min_duration_minutes)
 
 # get free times per day
 def get_free_times_for_day(busy_intervals, day, tz, start_hour=8, end_hour=22, min_duration=30):
-    window_start = tz.localize(datetime.combine(day, datetime.min.time()).replace(hour=start_hour))
-    window_end = tz.localize(datetime.combine(day, datetime.min.time()).replace(hour=end_hour))
-    
-    # filter busy intervals for this day
-    day_busy = [
-        b for b in busy_intervals
-        if b['start'].date() == day
-        or b['end'].date() == day
-        or (b['start'].date() < day and b['end'].date() > day)
-    ]
-    
-    return find_free_time(day_busy, window_start, window_end, min_duration_minutes=min_duration)
+    return as_calendar(busy_intervals).free_windows_for_day(day, tz, start_hour, end_hour, min_duration)
+
+# free times shared by several users (one busy list or calendar per user)
+def get_common_free_times_for_day(busy_lists, day, tz, start_hour=8, end_hour=22, min_duration=30):
+    return union_calendars(busy_lists).free_windows_for_day(day, tz, start_hour, end_hour, min_duration)
 
 
 def ask_user_preferences():
@@ -192,18 +176,18 @@ def main():
     print("=== Study Room Preferences ===")
     print("Fetching your calendar availability...")
     
-    # get real calendar data
-    busy_intervals = fetch_freebusy_from_api(['primary'], days_ahead=7)
-    
-    # use mock if API fails
+    # real calendar data, the mock week when the api is not available
+    busy_intervals, source = load_busy_intervals(['primary'], days_ahead=7)
     if busy_intervals is None:
-        print("Using mock schedule data (API not available)")
-        with open('Schedules/mockweek.json', 'r', encoding="utf-8") as f:
-            mock_json = json.load(f)
-        busy_intervals = parse_google_freebusy(mock_json)
-    else:
+        print("No calendar data available")
+        return
+    if source == "google":
         print("Successfully loaded your calendar!")
+    else:
+        print(f"Using {source} schedule data (API not available)")
+    calendar = BusyCalendar(busy_intervals)
     
+    import pytz
     tz = pytz.timezone("America/Los_Angeles")
     
     # dates for the next 5 weekdays
@@ -226,12 +210,7 @@ def main():
         
         out_file.write("=== Available Free Time Blocks ===\n")
         
-        for day in week_days:
-            free_times = get_free_times_for_day(
-                busy_intervals, day, tz,
-                start_hour=8, end_hour=22, min_duration=30
-            )
-            
+        for day, free_times in calendar.free_windows_by_day(week_days, tz, start_hour=8, end_hour=22, min_duration=30):
             out_file.write(f"{day.strftime('%A %Y-%m-%d')}:\n")
             
             if free_times:
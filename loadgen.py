@@ -0,0 +1,122 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+
+# load generator for server.py: N concurrent keep-alive clients firing search requests
+# prints throughput and latency percentiles, --json for machine readable output
+
+QUERIES = [
+    "group", "quiet", "whiteboard table", "langson group", "science private", "huge big",
+    "tech enhanced", "study pod", "capacity 6", "quiet AND private", "group NOT langson",
+    "feature:whiteboard", "space:science display", "\"tech enhanced\" group", "single quiet"
+]
+CAPACITIES = [None, None, 2, 4, 6]
+DURATIONS = [30, 60, 90, 120]
+LOCATIONS = [None, (33.643, -117.8465), (33.6475, -117.841)]
+
+
+def random_request(rng):
+    return {
+        "query": rng.choice(QUERIES),
+        "min_capacity": rng.choice(CAPACITIES),
+        "duration_minutes": rng.choice(DURATIONS),
+        "k": 5,
+        "user_location": rng.choice(LOCATIONS)
+    }
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[i]
+
+async def post(reader, writer, host, path, payload):
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+async def client(host, port, n, batch_size, rng, latencies, counters):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(n):
+            if batch_size > 1:
+                path, payload = "/batch", {"requests": [random_request(rng) for _ in range(batch_size)]}
+            else:
+                path, payload = "/search", random_request(rng)
+
+            t0 = time.perf_counter()
+            status, _ = await post(reader, writer, host, path, payload)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            counters["ok" if status == 200 else "failed"] += 1
+    finally:
+        writer.close()
+
+async def run(host, port, concurrency, requests, batch_size, seed):
+    rng = random.Random(seed)
+    latencies = []
+    counters = {"ok": 0, "failed": 0}
+
+    per_client = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(host, port, n, batch_size, rng, latencies, counters) for n in per_client if n))
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "queries": len(latencies) * batch_size,
+        "ok": counters["ok"],
+        "failed": counters["failed"],
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "queries_per_second": round(len(latencies) * batch_size / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(latencies[-1], 2) if latencies else 0.0
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the study spot query server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8125)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=1, help="queries per request, > 1 uses /batch")
+    parser.add_argument("--seed", type=int, default=125)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.host, args.port, args.concurrency, args.requests, args.batch_size, args.seed))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    lat = report["latency_ms"]
+    print(f"{report['requests']} requests ({report['queries']} queries) in {report['seconds']} s, "
+          f"{report['ok']} ok, {report['failed']} failed")
+    print(f"Throughput: {report['requests_per_second']} req/s, {report['queries_per_second']} queries/s")
+    print(f"Latency: p50 {lat['p50']} ms | p95 {lat['p95']} ms | p99 {lat['p99']} ms | max {lat['max']} ms")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,19 @@
 import json
-from haversine import haversine, Unit
+import heapq
+from pathlib import Path
+import numpy as np
+
+# spatial index: points live on the unit sphere as xyz vectors, a k-d tree over those
+# answers k nearest and "within R meters" without visiting every point.
+# straight line (chord) distance between unit vectors grows with the great circle distance,
+# so pruning on coordinates is exact, distances are converted back to meters at the end
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_MILE = 1609.344
+EARTH_RADIUS_MILES = 6371.0088 * 0.621371192  # the haversine package's radius, distances match it
+LEAF_SIZE = 16
+
+STUDY_SPOTS_DIR = Path(__file__).parent / "Study Spots"
 
 # loads library data: name and location
 def load_library(path):
@@ -12,30 +26,170 @@ def load_library(path):
 
     return library_name, (library_latitude, library_longitude)
 
-def get_closest_libraries(user_location, libraries):
-    # stores libraries from closest to farthest
-    results = []
+def load_libraries(folder=STUDY_SPOTS_DIR):
+    return [load_library(p) for p in sorted(Path(folder).rglob("*.json"))]
+
+def haversine_miles(user_location, lats, lons):
+    # haversine for many points at once
+    lat1, lon1 = np.radians(user_location[0]), np.radians(user_location[1])
+    lat2, lon2 = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+    d = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(d))
+
+def get_closest_libraries(user_location, libraries, k=None):
+    # stores libraries from closest to farthest, k -> only the k closest
+    if not libraries:
+        return []
+    names = [name for name, _ in libraries]
+    locations = np.array([loc for _, loc in libraries], dtype=float)
+    distances = haversine_miles(user_location, locations[:, 0], locations[:, 1])
+
+    order = np.argsort(distances, kind="stable")
+    if k is not None:
+        order = order[:k]
+    return [(names[i], float(distances[i])) for i in order]
+
+
+def to_unit_vectors(lats, lons):
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+def meters_to_chord(meters):
+    return 2 * np.sin(min(meters / EARTH_RADIUS_M, np.pi) / 2)
+
+def chord_to_meters(chord):
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.clip(chord / 2, 0.0, 1.0))
+
+
+class SpatialIndex:
+    '''
+    k-d tree over (lat, lon) points, ids: one id per point (room doc ids, space codes, ...)
+    points without a location (nan) are left out, points sharing a location share a tree node
+    '''
+    def __init__(self, lats, lons, ids=None):
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        ids = np.arange(len(lats)) if ids is None else np.asarray(ids)
+        has_loc = ~(np.isnan(lats) | np.isnan(lons))
+        lats, lons, ids = lats[has_loc], lons[has_loc], ids[has_loc]
+
+        # one tree point per distinct location, ids grouped per point (csr layout)
+        coords, inverse = np.unique(np.stack([lats, lons], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        member_order = np.argsort(inverse, kind="stable")
+        self.member_ids = ids[member_order]
+        self.member_starts = np.searchsorted(inverse[member_order], np.arange(len(coords) + 1))
+        self.coords = coords
+        self.size = len(ids)
+
+        # tree laid out in place: the median of every range is its node, split dim per node
+        self.points = to_unit_vectors(coords[:, 0], coords[:, 1]) if len(coords) else np.zeros((0, 3))
+        self.perm = np.arange(len(self.points))
+        self.split_dim = np.zeros(len(self.points), dtype=np.int8)
+        self.build(0, len(self.points))
+        self.tree_points = self.points[self.perm]
+
+    def build(self, lo, hi):
+        stack = [(lo, hi)]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            pts = self.points[self.perm[lo:hi]]
+            dim = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+            mid = (lo + hi) // 2
+            order = np.argpartition(pts[:, dim], mid - lo)
+            self.perm[lo:hi] = self.perm[lo:hi][order]
+            self.split_dim[mid] = dim
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+    def __len__(self):
+        return self.size
+
+    def point_ids(self, point):
+        return self.member_ids[self.member_starts[point]:self.member_starts[point + 1]]
+
+    def search(self, q, visit, bound):
+        # visit(tree positions, squared chord distances), bound() -> squared distance still of interest
+        stack = [(0, len(self.tree_points), 0.0)]
+        while stack:
+            lo, hi, min_d2 = stack.pop()
+            if min_d2 > bound():
+                continue
+            if hi - lo <= LEAF_SIZE:
+                if hi > lo:
+                    d = self.tree_points[lo:hi] - q
+                    visit(np.arange(lo, hi), np.einsum("ij,ij->i", d, d))
+                continue
+
+            mid = (lo + hi) // 2
+            dim = self.split_dim[mid]
+            d = self.tree_points[mid] - q
+            visit(np.array([mid]), np.array([d @ d]))
+
+            diff = q[dim] - self.tree_points[mid, dim]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            # far side is at least diff away, it is checked against the bound once the near side is done
+            stack.append((far[0], far[1], diff * diff))
+            stack.append((near[0], near[1], 0.0))
+
+    def nearest_points(self, location, k):
+        # k closest distinct locations -> [(point, meters)], closest first
+        if k <= 0 or not len(self.tree_points):
+            return []
+        q = to_unit_vectors(location[0], location[1])
+        heap = []  # (-squared chord, position), worst on top
+
+        def visit(positions, dist2):
+            for pos, d2 in zip(positions.tolist(), dist2.tolist()):
+                if len(heap) < k:
+                    heapq.heappush(heap, (-d2, pos))
+                elif d2 < -heap[0][0]:
+                    heapq.heapreplace(heap, (-d2, pos))
+
+        self.search(q, visit, lambda: -heap[0][0] if len(heap) == k else np.inf)
+        found = sorted((-neg_d2, pos) for neg_d2, pos in heap)
+        return [(int(self.perm[pos]), float(chord_to_meters(np.sqrt(d2)))) for d2, pos in found]
+
+    def within_points(self, location, radius_m):
+        # distinct locations within radius_m -> [(point, meters)], closest first
+        if not len(self.tree_points):
+            return []
+        q = to_unit_vectors(location[0], location[1])
+        r2 = meters_to_chord(radius_m) ** 2
+        found = []
+
+        def visit(positions, dist2):
+            hit = dist2 <= r2
+            found.extend(zip(dist2[hit].tolist(), positions[hit].tolist()))
+
+        self.search(q, visit, lambda: r2)
+        found.sort()
+        return [(int(self.perm[pos]), float(chord_to_meters(np.sqrt(d2)))) for d2, pos in found]
 
-    # calculates the distance between the user and each library
-    for library_name, library_location in libraries:
-        # haversine: calculates distance between two points on a sphere
-        distance = haversine(user_location, library_location, unit=Unit.MILES)
-        results.append((library_name, distance))
+    def nearest(self, location, k):
+        # k closest ids -> [(id, meters)], every point holds at least one id so k points are enough
+        results = []
+        for point, meters in self.nearest_points(location, k):
+            results.extend((int(i), meters) for i in self.point_ids(point))
+        return results[:k]
 
-    results.sort(key=lambda x: x[1])
-    return results
+    def within(self, location, radius_m):
+        # ids within radius_m as a sorted uint32 array (same form as postings)
+        points = [point for point, _ in self.within_points(location, radius_m)]
+        if not points:
+            return np.zeros(0, dtype=np.uint32)
+        ids = np.concatenate([self.point_ids(point) for point in points])
+        return np.sort(ids).astype(np.uint32)
 
 
 def main():
     # user_location = (latitude, longitude)
     user_location = (33.646, -117.843)
 
-    libraries = [
-        # load_library(r"C:\Users\katly\CS125-Study-Buddies\Study Spots\Langson_Library.json"),
-        # load_library(r"C:\Users\katly\CS125-Study-Buddies\Study Spots\Science_Library.json")
-        load_library(r"/home/ecasasca/cs125/CS125-Study-Buddies/Study Spots/Langson_Library.json"),
-        load_library(r"/home/ecasasca/cs125/CS125-Study-Buddies/Study Spots/Science_Library.json")
-    ]
+    libraries = load_libraries()
 
     results = get_closest_libraries(user_location, libraries)
 
@@ -1,42 +1,43 @@
-from location import get_closest_libraries, load_library
-from retrieval import load_room_docstore, retrieve_5_rooms, print_topres
-from input import fetch_freebusy_from_api, parse_google_freebusy, get_free_times_for_day, find_free_time
-import json
+from retrieval import (load_room_docstore, load_query_cache, save_query_cache, preload_partitions,
+                       save_partition_stats, retrieve_5_rooms, print_topres, closest_spaces)
+from calendars import load_busy_intervals
+from busycalendar import BusyCalendar
 from datetime import datetime, timedelta
-import pytz
+
+# start up cost matters (batch jobs run this entry point over and over): the calendar
+# provider and pytz are loaded on first use, see calendars.py and benchmark.py --startup
 
 def check_user_availability(duration_minutes=30):
     print("\nChecking your Google Calendar availability...")
     
-    # try to get calendar data
-    busy_intervals = fetch_freebusy_from_api(['primary'], days_ahead=7)
+    # try to get calendar data, the provider falls back to the mock schedule
+    busy_intervals, source = load_busy_intervals(['primary'], days_ahead=7)
     
-    # if api fails use mock schedule
     if busy_intervals is None:
-        print("API not available, using mock schedule data")
-        try:
-            with open('Schedules/mockweek.json', 'r', encoding="utf-8") as f:
-                mock_json = json.load(f)
-            busy_intervals = parse_google_freebusy(mock_json)
-        except FileNotFoundError:
-            print("   No mock schedule found, continuing without availability data")
-            return None, None, None
-    else:
+        print("   No calendar data found, continuing without availability data")
+        return None, None, None
+    if source == "google":
         print("Successfully loaded your calendar!")
+    else:
+        print(f"API not available, using {source} schedule data")
+
+    # merged once, the week below reuses it
+    calendar = BusyCalendar(busy_intervals)
     
+    import pytz
     tz = pytz.timezone("America/Los_Angeles")
     
     # get free times from today
     today = datetime.now(tz).date()
-    free_times = get_free_times_for_day(
-        busy_intervals, today, tz,
+    free_times = calendar.free_windows_for_day(
+        today, tz,
         start_hour=8, end_hour=22, 
         min_duration=duration_minutes
     )
     
-    return free_times, busy_intervals, tz
+    return free_times, calendar, tz
 
-def save_study_plan(busy_intervals, tz):
+def save_study_plan(calendar, tz):
     today = datetime.now(tz).date()
     days_until_monday = (7 - today.weekday()) % 7
     if days_until_monday == 0:
@@ -48,12 +49,7 @@ def save_study_plan(busy_intervals, tz):
     with open("study_plan.txt", "w", encoding="utf-8") as out_file: 
         out_file.write("=== Available Free Time Blocks ===\n")
         
-        for day in week_days:
-            free_times = get_free_times_for_day(
-                busy_intervals, day, tz,
-                start_hour=8, end_hour=22, min_duration=30
-            )
-            
+        for day, free_times in calendar.free_windows_by_day(week_days, tz, start_hour=8, end_hour=22, min_duration=30):
             out_file.write(f"{day.strftime('%A %Y-%m-%d')}:\n")
             
             if free_times:
@@ -76,22 +72,16 @@ def main():
     # set user location
     user_location = (33.643, -117.8465)
 
-    libraries = [
-        load_library(r"C:\Users\katly\CS125-Study-Buddies\Study Spots\Langson_Library.json"),
-        load_library(r"C:\Users\katly\CS125-Study-Buddies\Study Spots\Science_Library.json")
-        # load_library(r"/home/ecasasca/cs125/CS125-Study-Buddies/Study Spots/Langson_Library.json"),
-        # load_library(r"/home/ecasasca/cs125/CS125-Study-Buddies/Study Spots/Science_Library.json")
-    ]
-
-    # find closest library
-    libraries_results = get_closest_libraries(user_location, libraries)
-    closest_library = libraries_results[0][0]
+    # find closest library (spatial index over the indexed spaces)
+    libraries_results = closest_spaces(user_location, 1)
+    closest_library = libraries_results[0][0] if libraries_results else None
 
     print(f"\nclosest library: {closest_library}")
 
     print("\nChecking your availability...")
-    free_times, busy_intervals, tz = check_user_availability(30)
-    save_study_plan(busy_intervals, tz)
+    free_times, calendar, tz = check_user_availability(30)
+    if calendar is not None:
+        save_study_plan(calendar, tz)
 
     # display free times
     if free_times:
@@ -99,13 +89,16 @@ def main():
         for start, end in free_times:
             print(f"   {start.strftime('%I:%M %p')} - {end.strftime('%I:%M %p')}")
 
-    load_room_docstore()
+    load_query_cache()
+    preload_partitions()
     print("\nStudy Spot Seach (Early Demo)")
     print("Type a query. Optional commands:")
     print("     :cap N")
     print("     :dur MIN")
     print("     :clear")
     print("     quit/exit")
+    print("Query syntax: quiet AND private, NOT loud, -loud, \"tech enhanced\",")
+    print("     space:langson, feature:whiteboard, room:..., group cap:6 (at least 6 seats)")
 
     print("\nSearch for options:"
                       "\n\tlibs: langson, science"
@@ -126,6 +119,8 @@ def main():
             continue
         
         if query.lower() in {"quit", "exit"}:
+            save_query_cache()
+            save_partition_stats()
             break
 
         if query.startswith(":cap"):
@@ -147,12 +142,13 @@ def main():
         query_lower = query.lower()
         specified_library = ('langson' in query_lower) or ('science' in query_lower)
 
-        if specified_library:
+        if specified_library or closest_library is None:
             search_query = query
         else:
             search_query = f"{closest_library} {query}"
 
-        results = retrieve_5_rooms(search_query, min_capacity=min_cap, duration_minutes=(duration or 30), k=5)
+        results = retrieve_5_rooms(search_query, min_capacity=min_cap, duration_minutes=(duration or 30), k=5,
+                                   user_location=user_location)
         print_topres(results)
 
     # # retrieve results 
@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+# query metrics: per stage timings + candidate counts for every query (QueryTrace),
+# recorded into a metrics sink. the default sink is an in-process histogram registry that
+# dumps as prometheus text or json, set_metrics() swaps in anything with observe() / inc()
+#
+# stages (retrieval.retrieve_batch): normalize, postings_fetch (partition_load nested inside it),
+# score, capacity_filter, availability_scan, user_free_check, sort, format
+
+# seconds, tuned for ~0.1 ms stages up to multi second partition loads
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+SLOW_QUERY_LOG = os.environ.get("STUDY_BUDDIES_SLOW_QUERY_LOG")  # path, unset -> no slow query log
+SLOW_QUERY_MS = float(os.environ.get("STUDY_BUDDIES_SLOW_QUERY_MS", 50))
+SLOW_QUERY_SAMPLE = float(os.environ.get("STUDY_BUDDIES_SLOW_QUERY_SAMPLE", 1.0))
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+def format_labels(key, extra=None):
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts))
+        }
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}  # name -> {label key: Histogram}
+        self.counters = {}    # name -> {label key: value}
+        self.help = {}
+        self.name_buckets = {}  # histograms that don't measure seconds
+        self.lock = threading.Lock()
+
+    def describe(self, name, text, buckets=None):
+        self.help[name] = text
+        if buckets is not None:
+            self.name_buckets[name] = tuple(buckets)
+
+    def observe(self, name, value, labels=None):
+        key = label_key(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram(self.name_buckets.get(name, self.buckets))
+            hist.observe(value)
+
+    def inc(self, name, value=1, labels=None):
+        key = label_key(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": {
+                    name: [dict(labels=dict(key), **hist.to_dict()) for key, hist in series.items()]
+                    for name, series in self.histograms.items()
+                },
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in self.counters.items()
+                }
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{format_labels(key)} {value}")
+
+            for name, series in sorted(self.histograms.items()):
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, hist in series.items():
+                    cumulative = 0
+                    for bound, n in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{format_labels(key, ('le', bound))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(key)} {hist.sum}")
+                    lines.append(f"{name}_count{format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+class NullMetrics:
+    # metrics off: traces are still built (slow query log) but nothing is kept
+    def describe(self, name, text, buckets=None):
+        pass
+
+    def observe(self, name, value, labels=None):
+        pass
+
+    def inc(self, name, value=1, labels=None):
+        pass
+
+
+METRICS = MetricsRegistry()
+
+def get_metrics():
+    return METRICS
+
+def set_metrics(sink):
+    global METRICS
+    METRICS = sink
+    describe_query_metrics(sink)
+    return sink
+
+def describe_query_metrics(sink):
+    sink.describe("query_seconds", "Wall clock time of one query")
+    sink.describe("query_stage_seconds", "Time spent in a query stage")
+    sink.describe("query_stage_candidates_in_total", "Candidates entering a query stage")
+    sink.describe("query_stage_candidates_out_total", "Candidates leaving a query stage")
+    sink.describe("partition_loads_total", "Partition lookups while fetching postings, by cache result")
+    sink.describe("queries_total", "Queries answered, by result cache outcome")
+
+describe_query_metrics(METRICS)
+
+
+class SlowQueryLog:
+    # json lines of query traces slower than threshold_ms, sample_rate of those are kept
+    def __init__(self, path, threshold_ms=SLOW_QUERY_MS, sample_rate=SLOW_QUERY_SAMPLE):
+        self.path = path
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+
+    def maybe_log(self, trace):
+        if trace["total_ms"] < self.threshold_ms or random.random() >= self.sample_rate:
+            return False
+        line = json.dumps(dict(trace, logged_at=time.time()), ensure_ascii=False)
+        with self.lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                print(f"Could not write slow query log {self.path}: {e}")
+                return False
+        return True
+
+SLOW_LOG = SlowQueryLog(SLOW_QUERY_LOG) if SLOW_QUERY_LOG else None
+
+def configure_slow_query_log(path, threshold_ms=SLOW_QUERY_MS, sample_rate=SLOW_QUERY_SAMPLE):
+    # path None turns the log off
+    global SLOW_LOG
+    SLOW_LOG = SlowQueryLog(path, threshold_ms, sample_rate) if path else None
+    return SLOW_LOG
+
+
+class QueryTrace:
+    '''
+    one query: stage -> seconds, calls and candidates in / out, plus free form info
+    stages may run several times (availability is checked block by block), they add up
+    '''
+    def __init__(self, query):
+        self.query = query
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.info = {}
+        self.total = None
+
+    def get_stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {"seconds": 0.0, "calls": 0, "in": 0, "out": 0}
+        return stage
+
+    def add(self, name, seconds, entering=None, leaving=None):
+        stage = self.get_stage(name)
+        stage["seconds"] += seconds
+        stage["calls"] += 1
+        if entering is not None:
+            stage["in"] += int(entering)
+        if leaving is not None:
+            stage["out"] += int(leaving)
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def count(self, name, entering, leaving):
+        # candidates only, the time is taken by stage() / add()
+        stage = self.get_stage(name)
+        stage["in"] += int(entering)
+        stage["out"] += int(leaving)
+
+    def to_dict(self):
+        total = self.total if self.total is not None else time.perf_counter() - self.started
+        return {
+            "query": self.query,
+            "total_ms": round(total * 1000, 3),
+            "stages": {
+                name: {"ms": round(s["seconds"] * 1000, 3), "calls": s["calls"], "in": s["in"], "out": s["out"]}
+                for name, s in self.stages.items()
+            },
+            "info": self.info
+        }
+
+    def finish(self, sink=None, slow_log=None, **info):
+        self.total = time.perf_counter() - self.started
+        self.info.update(info)
+        record_trace(self.to_dict(), sink, slow_log)
+        return self
+
+
+def record_trace(trace, sink=None, slow_log=None):
+    # trace dict (QueryTrace.to_dict) -> sink; also used to replay traces made in worker processes
+    # slow_log None -> the configured SLOW_LOG, False -> no logging
+    sink = sink if sink is not None else METRICS
+    slow_log = SLOW_LOG if slow_log is None else slow_log
+
+    sink.observe("query_seconds", trace["total_ms"] / 1000)
+    sink.inc("queries_total", labels={"cache": "hit" if trace["info"].get("cached") else "miss"})
+    for name, s in trace["stages"].items():
+        labels = {"stage": name}
+        if s["calls"]:
+            sink.observe("query_stage_seconds", s["ms"] / 1000, labels)
+        if s["in"] or s["out"]:
+            sink.inc("query_stage_candidates_in_total", s["in"], labels)
+            sink.inc("query_stage_candidates_out_total", s["out"], labels)
+    for result in ("hit", "miss"):
+        n = trace["info"].get(f"partition_{result}s")
+        if n:
+            sink.inc("partition_loads_total", n, {"cache": result})
+
+    if slow_log:
+        slow_log.maybe_log(trace)
@@ -0,0 +1,265 @@
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+# partition cache bounded by bytes, with a pluggable eviction policy (lru / lfu / arc)
+# entries are (value, size) pairs, evicted values go to on_evict (e.g. to close a mmap)
+
+MISS = object()
+
+
+class LRUPolicy:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.bytes = 0
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return MISS
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def insert(self, key, value, size):
+        self.entries[key] = (value, size)
+        self.bytes += size
+        evicted = []
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            old_key, (old_value, old_size) = self.entries.popitem(last=False)
+            self.bytes -= old_size
+            evicted.append((old_key, old_value))
+        return evicted
+
+    def values(self):
+        return [value for value, _ in self.entries.values()]
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+
+class LFUPolicy(LRUPolicy):
+    # least frequently used, ties go to the least recently used
+    def __init__(self, max_bytes):
+        super().__init__(max_bytes)
+        self.freq = {}
+
+    def lookup(self, key):
+        value = super().lookup(key)
+        if value is not MISS:
+            self.freq[key] += 1
+        return value
+
+    def insert(self, key, value, size):
+        self.entries[key] = (value, size)
+        self.freq[key] = 1
+        self.bytes += size
+        evicted = []
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            # the new entry is protected, the scan is over the (few) cached partitions
+            old_key = min((k for k in self.entries if k != key), key=lambda k: self.freq[k])
+            old_value, old_size = self.entries.pop(old_key)
+            del self.freq[old_key]
+            self.bytes -= old_size
+            evicted.append((old_key, old_value))
+        return evicted
+
+    def clear(self):
+        super().clear()
+        self.freq.clear()
+
+
+class ARCPolicy:
+    '''
+    adaptive replacement cache, sized in bytes
+    t1: seen once, t2: seen again, b1 / b2: ghosts of recently evicted keys steering the t1 target p
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()  # key -> size
+        self.b2 = OrderedDict()
+        self.p = 0
+
+    @property
+    def bytes(self):
+        return sum(s for _, s in self.t1.values()) + sum(s for _, s in self.t2.values())
+
+    def lookup(self, key):
+        if key in self.t1:
+            self.t2[key] = self.t1.pop(key)
+            return self.t2[key][0]
+        if key in self.t2:
+            self.t2.move_to_end(key)
+            return self.t2[key][0]
+        return MISS
+
+    def replace(self, in_b2, protect):
+        t1_bytes = sum(s for _, s in self.t1.values())
+        from_t1 = self.t1 and (t1_bytes > self.p or (in_b2 and t1_bytes == self.p))
+        lists = [(self.t1, self.b1), (self.t2, self.b2)]
+        if not from_t1:
+            lists.reverse()
+
+        for source, ghosts in lists:
+            for old_key in source:
+                if old_key != protect:
+                    value, size = source.pop(old_key)
+                    ghosts[old_key] = size
+                    return old_key, value
+        return None
+
+    def insert(self, key, value, size):
+        if key in self.b1:
+            ratio = max(1.0, sum(self.b2.values()) / max(1, sum(self.b1.values())))
+            self.p = min(self.max_bytes, self.p + max(size, int(ratio * size)))
+            del self.b1[key]
+            self.t2[key] = (value, size)
+            in_b2 = False
+        elif key in self.b2:
+            ratio = max(1.0, sum(self.b1.values()) / max(1, sum(self.b2.values())))
+            self.p = max(0, self.p - max(size, int(ratio * size)))
+            del self.b2[key]
+            self.t2[key] = (value, size)
+            in_b2 = True
+        else:
+            self.t1[key] = (value, size)
+            in_b2 = False
+
+        evicted = []
+        while self.bytes > self.max_bytes and len(self.t1) + len(self.t2) > 1:
+            old = self.replace(in_b2, key)
+            if old is None:
+                break
+            evicted.append(old)
+
+        # ghosts only remember up to the cache size worth of keys
+        for ghosts in (self.b1, self.b2):
+            while ghosts and sum(ghosts.values()) > self.max_bytes:
+                ghosts.popitem(last=False)
+        return evicted
+
+    def values(self):
+        return [value for value, _ in list(self.t1.values()) + list(self.t2.values())]
+
+    def clear(self):
+        self.t1.clear()
+        self.t2.clear()
+        self.b1.clear()
+        self.b2.clear()
+        self.p = 0
+
+
+POLICIES = {
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "arc": ARCPolicy
+}
+
+
+class PartitionCache:
+    def __init__(self, max_bytes, policy="lru", on_evict=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown cache policy {policy!r}, expected one of {sorted(POLICIES)}")
+        self.max_bytes = max_bytes
+        self.policy_name = policy
+        self.policy = POLICIES[policy](max_bytes)
+        self.on_evict = on_evict
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.access_counts = {}  # key -> lookups, drives preloading
+
+    def get(self, key, loader):
+        '''
+        loader: key -> (value, size in bytes)
+        '''
+        self.access_counts[key] = self.access_counts.get(key, 0) + 1
+        value = self.policy.lookup(key)
+        if value is not MISS:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value, size = loader(key)
+        self.put(key, value, size)
+        return value
+
+    def put(self, key, value, size):
+        for old_key, old_value in self.policy.insert(key, value, size):
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(old_key, old_value)
+
+    def preload(self, keys, loader):
+        # fill the cache up to its budget, hottest keys first
+        for key in keys:
+            if self.policy.lookup(key) is not MISS:
+                continue
+            value, size = loader(key)
+            if self.policy.bytes + size > self.max_bytes:
+                if self.on_evict is not None:
+                    self.on_evict(key, value)
+                break
+            self.put(key, value, size)
+
+    def clear(self):
+        if self.on_evict is not None:
+            for value in self.policy.values():
+                self.on_evict(None, value)
+        self.policy.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "policy": self.policy_name,
+            "max_bytes": self.max_bytes,
+            "bytes": self.policy.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def hot_keys(self, n=None):
+        keys = sorted(self.access_counts, key=self.access_counts.get, reverse=True)
+        return keys if n is None else keys[:n]
+
+    # access counts persist between runs so startup can preload the hottest partitions
+    # label(key) -> name kept on disk, resolve(name) -> current keys; partition files are
+    # renamed by every build, so retrieval labels them by the term range they hold
+    def labeled_access_counts(self, label=None):
+        counts = {}
+        for key, count in self.access_counts.items():
+            name = label(key) if label is not None else key
+            if name is not None:
+                counts[name] = counts.get(name, 0) + count
+        return counts
+
+    def add_access_counts(self, counts, resolve=None):
+        for name, count in counts.items():
+            for key in (resolve(name) if resolve is not None else [name]):
+                self.access_counts[key] = self.access_counts.get(key, 0) + count
+
+    def save_access_counts(self, path, label=None):
+        path = Path(path)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.labeled_access_counts(label), f)
+        os.replace(tmp_path, path)
+
+    def load_access_counts(self, path, resolve=None):
+        path = Path(path)
+        if not path.exists():
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                counts = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring partition stats {path}: {e}")
+            return
+        self.add_access_counts(counts, resolve)
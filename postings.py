@@ -0,0 +1,181 @@
+import mmap
+import struct
+from array import array
+from pathlib import Path
+
+# binary postings format (one file per partition / run)
+#
+#   [postings]   delta encoded doc ids, varint compressed, one block per term
+#   [term dict]  fixed width records sorted by term -> binary searchable
+#   [term pool]  utf-8 term bytes referenced by the term dict
+#   [footer]     magic, version, number of terms, dict offset, pool offset
+#
+# postings are binary presence (tf = 1, weight = 1.0) so only doc ids are stored
+# in memory a postings list is a sorted array('I') of doc ids
+
+MAGIC = b"SBPX"
+VERSION = 1
+POSTINGS_SUFFIX = ".bin"
+
+FOOTER = struct.Struct("<4sHIQQ")
+TERM_RECORD = struct.Struct("<QHQII")  # pool offset, term len, postings offset, postings len, doc freq
+
+
+def encode_varint(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def encode_doc_ids(doc_ids):
+    # doc ids must be sorted ascending, gaps are stored instead of ids
+    out = bytearray()
+    prev = 0
+    for doc_id in doc_ids:
+        encode_varint(doc_id - prev, out)
+        prev = doc_id
+    return bytes(out)
+
+def decode_doc_ids(buf, start=0, end=None):
+    if end is None:
+        end = len(buf)
+
+    doc_ids = array("I")
+    doc_id = 0
+    n = 0
+    shift = 0
+    for b in buf[start:end]:
+        n |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        doc_id += n
+        doc_ids.append(doc_id)
+        n = 0
+        shift = 0
+    return doc_ids
+
+
+class PostingsWriter:
+    '''
+    streams postings to disk, terms have to be added in sorted order
+    only the (small) term dictionary is kept in memory
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+        self.f = open(self.path, "wb")
+        self.offset = 0
+        self.records = []
+        self.pool = bytearray()
+        self.last_term = None
+
+    def add(self, term, doc_ids):
+        term_bytes = term.encode("utf-8")
+        if self.last_term is not None and term_bytes <= self.last_term:
+            raise ValueError(f"terms must be added in sorted order: {term!r}")
+        self.last_term = term_bytes
+
+        block = encode_doc_ids(doc_ids)
+        self.f.write(block)
+        self.records.append((len(self.pool), len(term_bytes), self.offset, len(block), len(doc_ids)))
+        self.pool += term_bytes
+        self.offset += len(block)
+
+    @property
+    def size(self):
+        # bytes the file will have once closed
+        return self.offset + len(self.records) * TERM_RECORD.size + len(self.pool) + FOOTER.size
+
+    def close(self):
+        dict_offset = self.offset
+        for rec in self.records:
+            self.f.write(TERM_RECORD.pack(*rec))
+        pool_offset = dict_offset + len(self.records) * TERM_RECORD.size
+        self.f.write(self.pool)
+        self.f.write(FOOTER.pack(MAGIC, VERSION, len(self.records), dict_offset, pool_offset))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PostingsReader:
+    '''
+    memory maps a postings file and decodes one term at a time
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+        self.f = open(self.path, "rb")
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_terms, dict_offset, pool_offset = FOOTER.unpack_from(self.mm, len(self.mm) - FOOTER.size)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a postings file")
+
+        self.n_terms = n_terms
+        self.dict_offset = dict_offset
+        self.pool_offset = pool_offset
+
+    def __len__(self):
+        return self.n_terms
+
+    def record(self, i):
+        return TERM_RECORD.unpack_from(self.mm, self.dict_offset + i * TERM_RECORD.size)
+
+    def term_at(self, i):
+        pool_off, term_len, _, _, _ = self.record(i)
+        start = self.pool_offset + pool_off
+        return self.mm[start:start + term_len]
+
+    def find(self, term):
+        # binary search on the sorted term dict
+        target = term.encode("utf-8")
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term_at(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_terms and self.term_at(lo) == target:
+            return lo
+        return -1
+
+    def doc_freq(self, term):
+        i = self.find(term)
+        return self.record(i)[4] if i >= 0 else 0
+
+    def postings(self, term):
+        i = self.find(term)
+        if i < 0:
+            return array("I")
+        _, _, post_off, post_len, _ = self.record(i)
+        return decode_doc_ids(self.mm, post_off, post_off + post_len)
+
+    def items(self):
+        # sequential scan in term order
+        for i in range(self.n_terms):
+            pool_off, term_len, post_off, post_len, _ = self.record(i)
+            start = self.pool_offset + pool_off
+            term = self.mm[start:start + term_len].decode("utf-8")
+            yield term, decode_doc_ids(self.mm, post_off, post_off + post_len)
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_postings(path, index):
+    # index: {term: sorted doc ids}
+    with PostingsWriter(path) as w:
+        for term in sorted(index, key=lambda t: t.encode("utf-8")):
+            w.add(term, index[term])
@@ -0,0 +1,192 @@
+import re
+import numpy as np
+from indexer import field_term
+
+# query syntax
+#   quiet group            -> either term (ranked by how many match)
+#   quiet AND private      -> both required, same as +quiet +private
+#   NOT loud / -loud       -> excluded
+#   "tech enhanced"        -> every word required (no positions in the index)
+#   space:langson          -> field scoped, fields: space, room, feature, date
+#   cap:6                  -> at least 6 seats, narrows the other terms like a FILTER clause
+#
+# FILTER clauses come from cap:N and from retrieval (duration buckets), they narrow the candidates but are not scored
+
+SHOULD = "should"
+MUST = "must"
+MUST_NOT = "must_not"
+FILTER = "filter"
+
+FIELD_ALIASES = {
+    "space": "space",
+    "library": "space",
+    "lib": "space",
+    "room": "room",
+    "feature": "feature",
+    "feat": "feature",
+    "date": "date",
+    "day": "date"
+}
+
+# numeric fields, not index terms: field_term("min_capacity", "6") is resolved by the fetch function
+FILTER_FIELDS = {
+    "cap": "min_capacity",
+    "capacity": "min_capacity"
+}
+
+QUERY_TOKEN_RE = re.compile(r'([+-]?)(?:([A-Za-z]+):)?(?:"([^"]*)"?|([^\s"]+))')
+
+
+class Clause:
+    def __init__(self, occur, stems):
+        self.occur = occur
+        self.stems = stems  # all stems have to match for the clause to match
+
+    def __repr__(self):
+        return f"Clause({self.occur}, {self.stems})"
+
+
+def parse_query(q, normalize):
+    '''
+    returns a list of Clause, normalize: text -> list of stems
+    '''
+    clauses = []
+    pending_occur = None
+    join_previous = False
+
+    for m in QUERY_TOKEN_RE.finditer(q):
+        sign, field, phrase, word = m.groups()
+        is_phrase = phrase is not None
+        text = phrase if is_phrase else word
+
+        if not sign and not field and not is_phrase and text in ("AND", "OR", "NOT"):
+            if text == "AND":
+                join_previous = True
+            elif text == "NOT":
+                pending_occur = MUST_NOT
+            continue
+
+        occur = pending_occur or {"+": MUST, "-": MUST_NOT}.get(sign, SHOULD)
+        if join_previous:
+            if occur == SHOULD:
+                occur = MUST
+            if clauses and clauses[-1].occur == SHOULD:
+                clauses[-1].occur = MUST
+        pending_occur = None
+        join_previous = False
+
+        filter_field = FILTER_FIELDS.get(field.lower()) if field else None
+        if filter_field and text.isdigit():
+            # -cap:6 excludes those rooms instead
+            clauses.append(Clause(MUST_NOT if occur == MUST_NOT else FILTER, [field_term(filter_field, text)]))
+            continue
+
+        scope = FIELD_ALIASES.get(field.lower()) if field else None
+        if field and scope is None:
+            # unknown field -> plain text
+            text = f"{field} {text}"
+
+        stems = normalize(text)
+        if scope:
+            stems = [field_term(scope, s) for s in stems]
+        stems = list(dict.fromkeys(stems))
+        if not stems:
+            continue
+
+        if occur == SHOULD and not is_phrase:
+            clauses.extend(Clause(SHOULD, [s]) for s in stems)
+        else:
+            clauses.append(Clause(occur, stems))
+
+    return clauses
+
+
+# sorted postings operations, on sorted uint32 numpy arrays of doc ids
+EMPTY = np.zeros(0, dtype=np.uint32)
+
+def as_sorted_array(doc_ids):
+    return np.asarray(doc_ids, dtype=np.uint32) if len(doc_ids) else EMPTY
+
+def contains_sorted(arr, values):
+    # bool mask: values found in arr, one binary search per value
+    values = np.asarray(values)
+    if not len(arr):
+        return np.zeros(len(values), dtype=bool)
+    idx = np.searchsorted(arr, values)
+    idx[idx == len(arr)] = len(arr) - 1
+    return arr[idx] == values
+
+def intersect_sorted(a, b):
+    # binary search the smaller list into the larger one
+    if len(a) > len(b):
+        a, b = b, a
+    return a[contains_sorted(b, a)]
+
+def intersect_many(lists):
+    # smallest list first so every step only shrinks the result
+    if not lists:
+        return EMPTY
+    lists = sorted(lists, key=len)
+    result = lists[0]
+    for other in lists[1:]:
+        if not len(result):
+            break
+        result = intersect_sorted(result, other)
+    return result
+
+def union_sorted(lists):
+    lists = [l for l in lists if len(l)]
+    if not lists:
+        return EMPTY
+    if len(lists) == 1:
+        return lists[0]
+    return np.unique(np.concatenate(lists))
+
+def difference_sorted(a, b):
+    return a[~contains_sorted(b, a)]
+
+
+def execute_query(clauses, fetch, allowed=None):
+    '''
+    fetch: stem -> sorted uint32 array of doc ids
+    allowed: optional sorted doc ids every result has to be in (spatial pre-filter), acts as a FILTER
+    returns (scored stems in query order, {stem: sorted doc ids limited to the candidates},
+             {stem: document frequency})
+    '''
+    fetched = {}
+
+    def postings(stem):
+        if stem not in fetched:
+            fetched[stem] = fetch(stem)
+        return fetched[stem]
+
+    def clause_docs(clause):
+        return intersect_many([postings(s) for s in clause.stems])
+
+    filters = [clause_docs(c) for c in clauses if c.occur == FILTER]
+    if allowed is not None:
+        filters.append(allowed)
+    must = [clause_docs(c) for c in clauses if c.occur == MUST]
+    if must:
+        # filters join the intersection, smallest list goes first
+        candidates = intersect_many(must + filters)
+    else:
+        should = [clause_docs(c) for c in clauses if c.occur == SHOULD]
+        if filters:
+            narrowed = intersect_many(filters)
+            if len(narrowed) < sum(len(l) for l in should):
+                # filter is the more selective side -> narrow every list before the union
+                should = [intersect_sorted(l, narrowed) for l in should]
+                candidates = union_sorted(should)
+            else:
+                candidates = intersect_sorted(union_sorted(should), narrowed)
+        else:
+            candidates = union_sorted(should)
+
+    for c in clauses:
+        if c.occur == MUST_NOT and len(candidates):
+            candidates = difference_sorted(candidates, clause_docs(c))
+
+    stems = list(dict.fromkeys(s for c in clauses if c.occur in (MUST, SHOULD) for s in c.stems))
+    limited = {s: intersect_sorted(postings(s), candidates) for s in stems}
+    return stems, limited, {s: len(postings(s)) for s in stems}
@@ -0,0 +1,102 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# query result cache: LRU + TTL, invalidated by the index generation
+# persisted entries carry the generation they were computed on, not their expiry:
+# a restart on the same generation gets them back with a fresh TTL
+
+
+class QueryCache:
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation = None
+        self.entries = OrderedDict()  # key -> (expires_at, results)
+        self.hits = 0
+        self.misses = 0
+
+    def set_generation(self, generation):
+        # a new index generation makes every cached result stale
+        if generation != self.generation:
+            self.entries.clear()
+            self.generation = generation
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, results = entry
+        if expires_at < time.time():
+            del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return [(roomdoc_id, count, start, set(terms)) for roomdoc_id, count, start, terms in results]
+
+    def put(self, key, results):
+        frozen = tuple((roomdoc_id, count, start, frozenset(terms)) for roomdoc_id, count, start, terms in results)
+        self.entries[key] = (time.time() + self.ttl_seconds, frozen)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    # optional persistence so a restarted process starts warm
+    def save(self, path):
+        path = Path(path)
+        now = time.time()
+        data = {
+            "generation": self.generation,
+            "entries": [
+                [json.dumps(key), [[r[0], r[1], r[2], sorted(r[3])] for r in results]]
+                for key, (expires_at, results) in self.entries.items()
+                if expires_at >= now
+            ]
+        }
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, path, generation):
+        # only entries of the current index generation, every one starts a new TTL
+        self.set_generation(generation)
+        path = Path(path)
+        if not path.exists():
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring query cache {path}: {e}")
+            return
+
+        if generation is None or data.get("generation") != generation:
+            return
+
+        expires_at = time.time() + self.ttl_seconds
+        for key, results in data.get("entries", []):
+            key = to_key(json.loads(key))
+            self.entries[key] = (expires_at, tuple((r[0], r[1], r[2], frozenset(r[3])) for r in results))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+def to_key(value):
+    # json lists back to the hashable tuples used as keys
+    if isinstance(value, list):
+        return tuple(to_key(v) for v in value)
+    return value
@@ -0,0 +1,80 @@
+import heapq
+import math
+import numpy as np
+from location import haversine_miles
+
+# ranking: bm25 text score (binary tf) + proximity + how soon the room frees up
+K1 = 1.2
+B = 0.75
+PROXIMITY_WEIGHT = 1.0  # full weight at 0 miles, half at 1 mile
+SOON_WEIGHT = 1.0       # full weight when free at opening, half an hour later ~0.67
+BLOCK_SIZE = 64
+
+
+def idf(doc_freq, num_docs):
+    return math.log(1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+def bm25_norm(doc_len, avg_doc_len):
+    # bm25 with tf = 1, only the length normalisation is left per doc
+    return (K1 + 1) / (1 + K1 * (1 - B + B * doc_len / avg_doc_len))
+
+def text_scores(stems, postings, num_docs, doc_freqs=None):
+    '''
+    postings: {stem: sorted doc ids}
+    returns (doc ids in first seen order, matched stem counts, summed idf)
+    doc_freqs defaults to the postings lengths (when they aren't limited to a candidate set)
+    '''
+    lists = [np.asarray(postings[s], dtype=np.int64) for s in stems]
+    if not lists:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0)
+
+    if doc_freqs is None:
+        doc_freqs = {s: len(postings[s]) for s in stems}
+    weights = np.concatenate([np.full(len(l), idf(doc_freqs[s], num_docs)) for s, l in zip(stems, lists)])
+    ids, first_seen, inverse, counts = np.unique(np.concatenate(lists), return_index=True,
+                                                 return_inverse=True, return_counts=True)
+    idf_sums = np.bincount(inverse, weights=weights, minlength=len(ids))
+
+    order = np.argsort(first_seen, kind="stable")
+    return ids[order], counts[order], idf_sums[order]
+
+def space_distances(table, user_location):
+    # miles from the user to every space in the table, nan without a location
+    if user_location is None:
+        return np.full(len(table.space_ids), np.nan)
+    return haversine_miles(user_location, table.space_lat, table.space_lon)
+
+def proximity_scores(miles):
+    return np.where(np.isnan(miles), 0.0, PROXIMITY_WEIGHT / (1 + np.nan_to_num(miles)))
+
+def soon_scores(start_offset_minutes):
+    return SOON_WEIGHT / (1 + start_offset_minutes / 60)
+
+def rank_top_k(base_scores, k, evaluate, max_bonus, block_size=BLOCK_SIZE):
+    '''
+    bounded heap top-k with early termination
+    candidates are visited by base score, evaluate(positions) filters a block and
+    returns (kept positions, bonus scores, extra); once base + max_bonus of the next
+    block can't beat the current k-th best the remaining candidates are skipped
+    '''
+    order = np.argsort(-base_scores, kind="stable")
+    heap = []
+
+    for start in range(0, len(order), block_size):
+        block = order[start:start + block_size]
+        if len(heap) == k and base_scores[block[0]] + max_bonus < heap[0][0]:
+            break
+
+        kept, bonus, extra = evaluate(block)
+        scores = base_scores[kept] + bonus
+        for i, pos in enumerate(kept):
+            # ties go to the earlier candidate
+            item = (float(scores[i]), -int(pos), int(pos), extra[i])
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    heap.sort(reverse=True)
+    return [(pos, score, ex) for score, _, pos, ex in heap]
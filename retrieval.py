@@ -1,36 +1,221 @@
+import os
 import json
 import math
 import time
 import re
-from indexer import get_partition
+from bisect import bisect_left, bisect_right
+from indexer import (DURATION_BUCKETS, duration_bucket, field_term, load_manifest, load_partition_routes, route_term, run_path,
+                     AVAILABILITY_NAME, DOCMAP_NAME, DOCSTORE_NAME, DOCSTORE_OFFSETS_NAME, MANIFEST_NAME,
+                     ROOM_COLUMNS_NAME)
+from docstore import SPACES_NAME, DocStore
+from segment import current_segment_dir, verify_segment
+from tokenizer import STEM_CACHE, load_stem_cache, stem_tokens
+from postings import POSTINGS_SUFFIX, PostingsReader
+from availability import AvailabilityStore
+from roomtable import RoomTable
+from location import METERS_PER_MILE, SpatialIndex
+import metrics
+from metrics import QueryTrace
+from querycache import QueryCache
+from partitioncache import PartitionCache
+from query import (EMPTY, FILTER, FILTER_FIELDS, Clause, as_sorted_array, contains_sorted, difference_sorted,
+                   execute_query, parse_query, union_sorted)
+from ranking import SOON_WEIGHT, bm25_norm, proximity_scores, rank_top_k, soon_scores, space_distances, text_scores
 from pathlib import Path
-from nltk.stem import PorterStemmer
-from collections import OrderedDict
+import numpy as np
 
 BASE = Path(__file__).parent
 INDEX_DIR = BASE / "Index"
 STUDY_PLAN_PATH = BASE / "study_plan.txt"
 
-ROOMDOCMAP_PATH = INDEX_DIR / "roomdocmap.tsv"
-ROOMDOCSTORE_PATH = INDEX_DIR / "roomdocstore.jsonl"
+# live segment (see segment.py), the paths below follow it on every swap
+SEGMENT_DIR = None
+ROOMDOCMAP_PATH = None
+ROOMDOCSTORE_PATH = None
+AVAILABILITY_PATH = None
+MANIFEST_PATH = None
+QUERY_CACHE_PATH = INDEX_DIR / "query_cache.json"
 PARTIAL_PREFIX = "inverted_index_"
 
-stemmer = PorterStemmer()
-TOKEN_RE = re.compile(r"\b[a-zA-Z0-9]+\b")
-
 ROOMDOCMAP = {}
 ROOMDOCSTORE = {}
+AVAILABILITY = None
+ROOM_TABLE = None
+SPATIAL_INDEX = None  # k-d tree over room locations (room doc ids)
+SPACE_INDEX = None    # same over space locations (space codes of ROOM_TABLE)
+
+# routing table: first term of every partition (see indexer.merge_sources)
+PARTITION_FIRST_TERMS = []
+PARTITION_NAMES = []
+
+# incremental updates not merged yet (see indexer.update_index)
+DELTA_RUNS = []
+DELETED_ROOMDOCS = EMPTY  # sorted doc ids
+DURATION_POSTINGS = {}  # bucket -> sorted doc ids, from the availability store (see indexer.DURATION_BUCKETS)
+MIN_CAPACITY_FIELD = FILTER_FIELDS["cap"]
+
+def open_current_segment():
+    global SEGMENT_DIR, ROOMDOCMAP_PATH, ROOMDOCSTORE_PATH, AVAILABILITY_PATH, MANIFEST_PATH
+    SEGMENT_DIR = current_segment_dir(INDEX_DIR)
+    ROOMDOCMAP_PATH = SEGMENT_DIR / DOCMAP_NAME
+    ROOMDOCSTORE_PATH = SEGMENT_DIR / DOCSTORE_NAME
+    AVAILABILITY_PATH = SEGMENT_DIR / AVAILABILITY_NAME
+    MANIFEST_PATH = SEGMENT_DIR / MANIFEST_NAME
+
+    # sizes only, the full checksum pass is indexer.py --verify
+    if SEGMENT_DIR != INDEX_DIR:
+        for problem in verify_segment(SEGMENT_DIR):
+            print(f"Index segment {SEGMENT_DIR.name}: {problem}")
 
 def load_room_docmap():
+    if ROOMDOCMAP_PATH is None:
+        open_current_segment()
     with open(ROOMDOCMAP_PATH, "r", encoding="utf-8") as f:
         for line in f:
             room_doc_id, uid = line.strip().split("\t", 1)
             ROOMDOCMAP[int(room_doc_id)] = uid
 
 def load_room_docstore():
-    with open(ROOMDOCSTORE_PATH, "r", encoding="utf-8") as f:
-        for i, line in enumerate(f):
-            ROOMDOCSTORE[i] = json.loads(line)
+    # records are decoded on access, only the offsets and the spaces table are loaded
+    global ROOMDOCSTORE
+    open_current_segment()
+    read_index_generation()
+    if isinstance(ROOMDOCSTORE, DocStore):
+        ROOMDOCSTORE.close()
+    ROOMDOCSTORE = DocStore(ROOMDOCSTORE_PATH, SEGMENT_DIR / DOCSTORE_OFFSETS_NAME, SEGMENT_DIR / SPACES_NAME)
+
+    # delta rooms are appended to the docstore, so pick up their runs with it
+    load_delta_runs()
+    load_availability_store()
+
+    global ROOM_TABLE, SPATIAL_INDEX, SPACE_INDEX
+    ROOM_TABLE = RoomTable(ROOMDOCSTORE, AVAILABILITY, SEGMENT_DIR / ROOM_COLUMNS_NAME)
+    DURATION_POSTINGS.clear()
+    SPATIAL_INDEX = SpatialIndex(ROOM_TABLE.lat, ROOM_TABLE.lon)
+    SPACE_INDEX = SpatialIndex(ROOM_TABLE.space_lat, ROOM_TABLE.space_lon)
+
+# spatial queries, sub linear through the k-d trees built with the room table
+def closest_spaces(user_location, k=1):
+    # [(space name, miles)] closest first
+    return [(ROOM_TABLE.space_names[code], meters / METERS_PER_MILE)
+            for code, meters in SPACE_INDEX.nearest(user_location, k)]
+
+def rooms_within(user_location, radius_m):
+    # sorted room doc ids within radius_m meters
+    return SPATIAL_INDEX.within(user_location, radius_m)
+
+def load_availability_store():
+    # mapped read only, in place refreshes by the indexer show up without a reload
+    global AVAILABILITY
+    if AVAILABILITY is not None:
+        AVAILABILITY.close()
+        AVAILABILITY = None
+    if AVAILABILITY_PATH.exists():
+        AVAILABILITY = AvailabilityStore(AVAILABILITY_PATH)
+
+def load_delta_runs():
+    global DELETED_ROOMDOCS
+    for reader in DELTA_RUNS:
+        reader.close()
+    DELTA_RUNS.clear()
+    DELETED_ROOMDOCS = EMPTY
+
+    # a delta merge rewrites the partitions -> drop the mapped ones and reroute,
+    # the access counts move over by term range
+    PARTITION_CACHE.clear()
+    counts = PARTITION_CACHE.labeled_access_counts(partition_range)
+    first_terms, parts = load_partition_routes(SEGMENT_DIR)
+    PARTITION_FIRST_TERMS[:] = first_terms
+    PARTITION_NAMES[:] = parts
+    PARTITION_CACHE.access_counts.clear()
+    PARTITION_CACHE.add_access_counts(counts, partitions_in_range)
+
+    # corpus vocabulary -> query tokens skip the stemmer
+    load_stem_cache(SEGMENT_DIR)
+
+    manifest = load_manifest(SEGMENT_DIR)
+    if manifest is None:
+        return
+
+    for run_id in manifest["delta_runs"]:
+        path = run_path(SEGMENT_DIR, run_id)
+        if path.exists():
+            DELTA_RUNS.append(PostingsReader(path))
+    DELETED_ROOMDOCS = as_sorted_array(manifest["deleted"])
+
+# result cache, keyed by the parsed query + filters
+QUERY_CACHE = QueryCache(max_entries=1024, ttl_seconds=300)
+manifest_stamp = None
+index_gen = None
+index_state = None
+
+def read_manifest():
+    # (mtime stamp, manifest), stamped before reading so a change in between is seen next time
+    try:
+        stamp = os.stat(MANIFEST_PATH).st_mtime_ns
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return stamp, json.load(f)
+    except FileNotFoundError:
+        return None, None
+
+def text_state(manifest):
+    # what the loaded docstore, delta runs and room table depend on, any other change is slots only
+    if manifest is None:
+        return None
+    return manifest.get("next_doc_id"), manifest.get("delta_runs"), manifest.get("deleted")
+
+def read_index_generation():
+    global manifest_stamp, index_gen, index_state
+    manifest_stamp, manifest = read_manifest()
+    index_gen = manifest.get("generation") if manifest is not None else None
+    index_state = text_state(manifest)
+
+def refresh_availability(manifest):
+    '''
+    catch up on slots only generations without a reload, False when the refresh log doesn't cover them
+    the availability store is patched in place and mapped shared, so its records are current already;
+    only the longest free runs of the refreshed rooms and the bucket postings built from them are redone
+    '''
+    if AVAILABILITY is None or index_gen is None:
+        return False
+    log = {generation: doc_ids for generation, doc_ids in manifest.get("refreshed", [])}
+    changed = set()
+    for generation in range(index_gen + 1, manifest.get("generation", 0) + 1):
+        if generation not in log:
+            return False
+        changed.update(log[generation])
+
+    ROOM_TABLE.refresh_rows(np.array(sorted(changed), dtype=np.int64))
+    DURATION_POSTINGS.clear()
+    return True
+
+def index_generation():
+    # a published segment swaps CURRENT -> reopen everything from the new one
+    # within a segment the manifest is replaced on every change, a stat is enough to notice:
+    # new rooms, delta runs or deletes reload the docstore side, slots only refreshes patch the affected rows
+    global manifest_stamp, index_gen
+    if SEGMENT_DIR is None:
+        return None
+    if current_segment_dir(INDEX_DIR) != SEGMENT_DIR:
+        load_room_docstore()
+        return index_gen
+    try:
+        stamp = os.stat(MANIFEST_PATH).st_mtime_ns
+    except FileNotFoundError:
+        stamp = None
+    if stamp != manifest_stamp:
+        stamp, manifest = read_manifest()
+        if manifest is None or text_state(manifest) != index_state or not refresh_availability(manifest):
+            load_room_docstore()
+        else:
+            manifest_stamp, index_gen = stamp, manifest.get("generation")
+    return index_gen
+
+def load_query_cache():
+    QUERY_CACHE.load(QUERY_CACHE_PATH, index_generation())
+
+def save_query_cache():
+    QUERY_CACHE.save(QUERY_CACHE_PATH)
 
 def load_user_free_times():
     try:
@@ -56,38 +241,110 @@ def load_user_free_times():
         return None
 
 def normalize_query(q):
-    tokens = TOKEN_RE.findall(q.lower())
-    return [stemmer.stem(t) for t in tokens]
+    return stem_tokens(q)
 
-MAX_PARTIALS = 3
-loaded_partials = OrderedDict()
+# partitions: memory mapped, terms are decoded on demand
+# the cache is bounded by mapped bytes, budget and policy are set per deployment
+PARTITION_CACHE_BYTES = int(os.environ.get("STUDY_BUDDIES_PARTITION_CACHE_BYTES", 64 * 1024 * 1024))
+PARTITION_CACHE_POLICY = os.environ.get("STUDY_BUDDIES_PARTITION_CACHE_POLICY", "lru")
+PARTITION_STATS_PATH = INDEX_DIR / "partition_stats.json"
 
-def load_partial(part):
-    if part in loaded_partials:
-        loaded_partials.move_to_end(part)
-        return loaded_partials[part]
-    
-    path = INDEX_DIR / f"{PARTIAL_PREFIX}{part}.json"
+def close_partial(part, reader):
+    if reader is not None:
+        reader.close()
+
+PARTITION_CACHE = PartitionCache(PARTITION_CACHE_BYTES, PARTITION_CACHE_POLICY, on_evict=close_partial)
+
+def open_partial(part):
+    path = SEGMENT_DIR / f"{PARTIAL_PREFIX}{part}{POSTINGS_SUFFIX}"
     if path.exists():
-        with open(path, "r", encoding="utf-8") as f:
-            loaded_partials[part] = json.load(f)
-    else:
-        loaded_partials[part] = {}
-
-    loaded_partials.move_to_end(part)
-    if len(loaded_partials) > MAX_PARTIALS:
-        loaded_partials.popitem(last=False)
-    
-    return loaded_partials[part]
-
-def get_postings_binary(term):
-    part = get_partition(term)
-    partial = load_partial(part)
-    postings = partial.get(term, [])
-    if not postings:
-        return set()
-    
-    return {p["room_doc_id"] for p in postings}
+        return PostingsReader(path), path.stat().st_size
+    return None, 0
+
+def load_partial(part):
+    return PARTITION_CACHE.get(part, open_partial)
+
+def configure_partition_cache(max_bytes=None, policy=None):
+    global PARTITION_CACHE
+    PARTITION_CACHE.clear()
+    PARTITION_CACHE = PartitionCache(
+        max_bytes if max_bytes is not None else PARTITION_CACHE_BYTES,
+        policy or PARTITION_CACHE_POLICY,
+        on_evict=close_partial
+    )
+
+def partition_range(part):
+    # "first term\tfirst term of the next partition" ("" = to the end), stays valid across rebuilds
+    if part not in PARTITION_NAMES:
+        return None
+    i = PARTITION_NAMES.index(part)
+    end = PARTITION_FIRST_TERMS[i + 1] if i + 1 < len(PARTITION_NAMES) else ""
+    return f"{PARTITION_FIRST_TERMS[i]}\t{end}"
+
+def partitions_in_range(term_range):
+    # current partitions overlapping a saved range
+    first, _, end = term_range.partition("\t")
+    if not PARTITION_NAMES:
+        return []
+    lo = max(bisect_right(PARTITION_FIRST_TERMS, first) - 1, 0)
+    hi = bisect_left(PARTITION_FIRST_TERMS, end) if end else len(PARTITION_NAMES)
+    return PARTITION_NAMES[lo:hi]
+
+def preload_partitions(parts=None, n=None):
+    # default: hottest partitions from previous runs, until the byte budget is used up
+    if parts is None:
+        PARTITION_CACHE.load_access_counts(PARTITION_STATS_PATH, partitions_in_range)
+        parts = PARTITION_CACHE.hot_keys(n)
+    PARTITION_CACHE.preload(parts, open_partial)
+
+def save_partition_stats():
+    PARTITION_CACHE.save_access_counts(PARTITION_STATS_PATH, partition_range)
+
+def min_capacity_postings(min_capacity):
+    # cap:N, straight from the room table column instead of the index
+    postings = np.nonzero(ROOM_TABLE.capacity >= min_capacity)[0].astype(np.uint32)
+    if len(DELETED_ROOMDOCS):
+        postings = difference_sorted(postings, DELETED_ROOMDOCS)
+    return postings
+
+def duration_postings(bucket):
+    # "duration:N" -> rooms with a free run of at least N minutes, kept until the availability changes
+    postings = DURATION_POSTINGS.get(bucket)
+    if postings is None:
+        postings = np.nonzero(ROOM_TABLE.longest_free_minutes() >= bucket)[0].astype(np.uint32)
+        if len(DELETED_ROOMDOCS):
+            postings = difference_sorted(postings, DELETED_ROOMDOCS)
+        DURATION_POSTINGS[bucket] = postings
+    return postings
+
+def get_postings_sorted(term, trace=None):
+    field, _, value = term.partition(":")
+    if field == MIN_CAPACITY_FIELD:
+        return min_capacity_postings(int(value))
+    if field == "duration" and value.isdigit():
+        return duration_postings(int(value))
+
+    part = route_term(PARTITION_FIRST_TERMS, PARTITION_NAMES, term)
+    partial = None
+    if part is not None:
+        if trace is None:
+            partial = load_partial(part)
+        else:
+            misses = PARTITION_CACHE.misses
+            t0 = time.perf_counter()
+            partial = load_partial(part)
+            trace.add("partition_load", time.perf_counter() - t0)
+            key = "partition_misses" if PARTITION_CACHE.misses != misses else "partition_hits"
+            trace.info[key] = trace.info.get(key, 0) + 1
+
+    # decoded array('I') -> sorted uint32 numpy array, no per doc python objects
+    postings = as_sorted_array(partial.postings(term)) if partial is not None else EMPTY
+    if DELTA_RUNS:
+        postings = union_sorted([postings] + [as_sorted_array(reader.postings(term)) for reader in DELTA_RUNS])
+
+    if len(DELETED_ROOMDOCS):
+        postings = difference_sorted(postings, DELETED_ROOMDOCS)
+    return postings
 
 
 # availabilty checker
@@ -108,98 +365,212 @@ def slot_to_12h(slot_indx, start_hhm, slot_minutes):
     start_mintes = hhmm_to_minutes(start_hhm)
     return minutes_to_12h(start_mintes + slot_indx * slot_minutes)
 
-def ceil_div(a, b):
-    return (a + b - 1) // b
-
-def is_range_available(bitset, start_slot, needed_slots):
-    end = start_slot + needed_slots
-    if start_slot < 0 or end > len(bitset):
-        return False
-    return all(bitset[i] == "1" for i in range(start_slot, end))
-
-def first_available_start(meta, duration_minutes):
-    room = meta["room"]
-    space = meta ["space"]
-
-    bitset = room.get("slots_bitset", "")
-    start_hhmm = space["hours"]["start"]
-    slot_minutes = space.get("slot_minutes", 30)
+# start times of one room, read off the earliest start table (see RoomTable.free_start_slots)
+def available_start_slots(roomdoc_id, duration_minutes):
+    return ROOM_TABLE.free_start_slots(roomdoc_id, duration_minutes)
 
-    needed = ceil_div(duration_minutes, slot_minutes)
+def all_available_starts(roomdoc_id, duration_minutes):
+    return [minutes_to_12h(int(ROOM_TABLE.start_minutes(roomdoc_id, slot)))
+            for slot in available_start_slots(roomdoc_id, duration_minutes)]
 
-    for i in range(len(bitset) - needed + 1):
-        if is_range_available(bitset, i , needed):
-            return slot_to_12h(i, start_hhmm, slot_minutes)
-    return None
+def first_available_start(roomdoc_id, duration_minutes):
+    slot = ROOM_TABLE.first_free_slots(np.array([roomdoc_id]), duration_minutes)[0]
+    if slot < 0:
+        return None
+    return minutes_to_12h(int(ROOM_TABLE.start_minutes(roomdoc_id, slot)))
+
+def retrieve_5_rooms(query, min_capacity=None, duration_minutes=None, k=5, user_location=None,
+                     user_free_times=None, verbose=True, max_distance_m=None):
+    # user_free_times: [(start min, end min)], None reads study_plan.txt, [] means no calendar constraint
+    # max_distance_m: only rooms within that many meters of user_location
+    filters = {
+        "min_capacity": min_capacity,
+        "duration_minutes": duration_minutes,
+        "k": k,
+        "user_location": user_location,
+        "user_free_times": user_free_times,
+        "max_distance_m": max_distance_m
+    }
+    return retrieve_batch([query], filters, verbose)[0]
+
+UNKNOWN_SLOT = -2
+
+def room_slots(memo, rows, duration_minutes):
+    # first free slot per room (-1 none) for the duration, computed once per room for the whole batch
+    slots = np.full(len(rows), -1, dtype=np.int64)
+    inside = rows < len(memo)
+    rows = rows[inside]
+
+    unknown = np.unique(rows[memo[rows] == UNKNOWN_SLOT])
+    if len(unknown):
+        memo[unknown] = ROOM_TABLE.first_free_slots(unknown, duration_minutes)
+
+    slots[inside] = memo[rows]
+    return slots
+
+def retrieve_batch(queries, filters=None, verbose=True, traces=None):
+    '''
+    queries: list of query strings
+    filters: one dict for every query or a list with one dict per query, keys as in retrieve_5_rooms
+             (min_capacity, duration_minutes, k, user_location, user_free_times, max_distance_m)
+    returns one result list per query: [(roomdoc_id, match_count, start_time, matched_terms)]
+    every stem is fetched once per batch, availability is checked once per room and
+    duration and shared between the queries
+    traces: optional list, gets one QueryTrace.to_dict() per query (stage timings, candidate counts),
+            every trace is also recorded into metrics.METRICS
+    '''
+    if filters is None or isinstance(filters, dict):
+        filters = [filters or {}] * len(queries)
+    if len(filters) != len(queries):
+        raise ValueError(f"got {len(filters)} filters for {len(queries)} queries")
 
-def is_user_free(room_time_str, user_free_times, duration_minutes):
-    if not user_free_times:
-        return True  
-    
-    # parse room time
-    time_part, ampm = room_time_str.split()
-    h, m = map(int, time_part.split(':'))
-    if ampm == 'PM' and h != 12:
-        h += 12
-    elif ampm == 'AM' and h == 12:
-        h = 0
-    room_start_min = h * 60 + m
-    room_end_min = room_start_min + duration_minutes
-    
-    # check if user is free during room availability
-    for user_start_min, user_end_min in user_free_times:
-        if user_start_min <= room_start_min and room_end_min <= user_end_min:
-            return True
-    return False
-
-def search_or(query):
-    stems = normalize_query(query)
-    matches = {}
-
-    for s in stems:
-        for d in get_postings_binary(s):
-            if d not in matches:
-                matches[d] = set()
-            matches[d].add(s)
-    return matches
-
-def retrieve_5_rooms(query, min_capacity=None, duration_minutes=None, k=5):
-    if duration_minutes is None:
-        duration_minutes = 30
-
-    user_free_times = load_user_free_times()
-    if user_free_times:
-        print(f"Loaded {len(user_free_times)} free time slots from study_plan.txt")
-    
     t0 = time.perf_counter()
-    matches = search_or(query)
-    results = []
-
-    for roomdoc_id, matched_terms in matches.items():
-        meta = ROOMDOCSTORE.get(roomdoc_id)
-        if not meta:
-            continue
-
-        cap = meta["room"].get("capacity")
-        if min_capacity is not None and (cap is None or cap < min_capacity):
-            continue
-
-        start_time = first_available_start(meta, duration_minutes)
-        if start_time is None:
-            continue
-
-        if not is_user_free(start_time, user_free_times, duration_minutes):
+    QUERY_CACHE.set_generation(index_generation())
+
+    study_plan = None
+    fetched = {}
+    slot_memos = {}
+    proximities = {}
+    nearby = {}
+    num_docs = max(ROOM_TABLE.num_docs - len(DELETED_ROOMDOCS), 1)
+    num_cached = 0
+    batch_results = []
+
+    trace = None
+
+    def fetch(stem):
+        if stem not in fetched:
+            fetched[stem] = get_postings_sorted(stem, trace)
+        return fetched[stem]
+
+    for query, f in zip(queries, filters):
+        min_capacity = f.get("min_capacity")
+        duration_minutes = f.get("duration_minutes") or 30
+        k = f.get("k") or 5
+        user_location = f.get("user_location")
+        user_free_times = f.get("user_free_times")
+        max_distance_m = f.get("max_distance_m") if user_location else None
+        if user_free_times is None:
+            if study_plan is None:
+                study_plan = load_user_free_times() or []
+                if study_plan and verbose:
+                    print(f"Loaded {len(study_plan)} free time slots from study_plan.txt")
+            user_free_times = study_plan
+        free_key = tuple(tuple(t) for t in user_free_times or ())
+
+        trace = QueryTrace(query)
+        with trace.stage("normalize"):
+            clauses = parse_query(query, normalize_query)
+        bucket = duration_bucket(duration_minutes, DURATION_BUCKETS)
+        if bucket is not None and clauses:
+            # only rooms with a long enough free run, checked on postings before any text scoring
+            clauses.append(Clause(FILTER, [field_term("duration", str(bucket))]))
+        cache_key = (
+            tuple((c.occur, tuple(c.stems)) for c in clauses),
+            min_capacity,
+            duration_minutes,
+            free_key,
+            k,
+            tuple(user_location) if user_location else None,
+            max_distance_m
+        )
+        cached = QUERY_CACHE.get(cache_key)
+        if cached is not None:
+            num_cached += 1
+            batch_results.append(cached)
+            finish_trace(trace, traces, cached=True, results=len(cached))
             continue
 
-        match_count = len(matched_terms)
-        results.append((roomdoc_id, match_count, start_time, matched_terms))
-    
-    results.sort(key=lambda x: x[1], reverse=True)
-    results = results[:k]
+        # AND / NOT / field scopes narrow the candidates before any availability check
+        # radius queries: rooms outside it never reach scoring
+        allowed = None
+        if max_distance_m is not None:
+            near_key = (tuple(user_location), max_distance_m)
+            if near_key not in nearby:
+                nearby[near_key] = rooms_within(user_location, max_distance_m)
+            allowed = nearby[near_key]
+        t_fetch = time.perf_counter()
+        stems, postings, doc_freqs = execute_query(clauses, fetch, allowed)
+        trace.add("postings_fetch", time.perf_counter() - t_fetch)
+
+        # bm25 text score, visited best first
+        with trace.stage("score"):
+            roomdoc_ids, counts, idf_sums = text_scores(stems, postings, num_docs, doc_freqs)
+            base_scores = idf_sums * bm25_norm(ROOM_TABLE.doc_len[roomdoc_ids], ROOM_TABLE.avg_doc_len)
+
+            location_key = tuple(user_location) if user_location else None
+            if location_key not in proximities:
+                proximities[location_key] = proximity_scores(space_distances(ROOM_TABLE, user_location))
+            proximity = proximities[location_key]
+            max_bonus = SOON_WEIGHT + (proximity.max() if len(proximity) else 0.0)
+        trace.count("postings_fetch", sum(doc_freqs.values()), len(roomdoc_ids))
+
+        if duration_minutes not in slot_memos:
+            slot_memos[duration_minutes] = np.full(ROOM_TABLE.n, UNKNOWN_SLOT, dtype=np.int64)
+        memo = slot_memos[duration_minutes]
+
+        def evaluate(block):
+            # capacity as an array mask, availability from the shared memo, then the user's free time
+            rows = roomdoc_ids[block]
+            n_in = len(rows)
+
+            t0 = time.perf_counter()
+            if min_capacity is not None:
+                keep = ROOM_TABLE.capacity[rows] >= min_capacity
+                block, rows = block[keep], rows[keep]
+            t1 = time.perf_counter()
+            trace.add("capacity_filter", t1 - t0, n_in, len(rows))
+
+            slots = room_slots(memo, rows, duration_minutes)
+            keep = slots >= 0
+            n_avail = len(rows)
+            block, rows, slots = block[keep], rows[keep], slots[keep]
+            t2 = time.perf_counter()
+            trace.add("availability_scan", t2 - t1, n_avail, len(rows))
+
+            if user_free_times:
+                keep = ROOM_TABLE.user_free_mask(rows, slots, duration_minutes, user_free_times)
+                n_free = len(rows)
+                block, rows, slots = block[keep], rows[keep], slots[keep]
+                trace.add("user_free_check", time.perf_counter() - t2, n_free, len(rows))
+
+            bonus = proximity[ROOM_TABLE.space_code[rows]] + soon_scores(slots * ROOM_TABLE.slot_minutes[rows])
+            return block, bonus, slots
+
+        t_rank = time.perf_counter()
+        top = rank_top_k(base_scores, k, evaluate, max_bonus)
+        # rank_top_k time minus the filters it called -> heap / sort work
+        filtered = sum(trace.stages[s]["seconds"] for s in ("capacity_filter", "availability_scan", "user_free_check")
+                       if s in trace.stages)
+        trace.add("sort", time.perf_counter() - t_rank - filtered, len(roomdoc_ids), len(top))
+
+        results = []
+        with trace.stage("format"):
+            top_ids = roomdoc_ids[[pos for pos, _, _ in top]]
+            matched = {s: contains_sorted(postings[s], top_ids) for s in stems}
+            for i, (pos, score, slot) in enumerate(top):
+                roomdoc_id = int(roomdoc_ids[pos])
+                space = ROOMDOCSTORE[roomdoc_id]["space"]
+                start_time = slot_to_12h(int(slot), space["hours"]["start"], space.get("slot_minutes", 30))
+                matched_terms = {s for s in stems if matched[s][i]}
+                results.append((roomdoc_id, int(counts[pos]), start_time, matched_terms))
+
+        QUERY_CACHE.put(cache_key, results)
+        batch_results.append(results)
+        finish_trace(trace, traces, cached=False, results=len(results))
 
     ms = (time.perf_counter() - t0) * 1000
-    print(f"Search time: {ms:.2f} ms")
-    return results
+    if verbose:
+        if len(queries) == 1:
+            print(f"Search time: {ms:.2f} ms" + (" (cached)" if num_cached else ""))
+        else:
+            print(f"Search time: {ms:.2f} ms for {len(queries)} queries ({num_cached} cached, {len(fetched)} postings fetched)")
+    return batch_results
+
+def finish_trace(trace, traces, **info):
+    trace.finish(**info)
+    if traces is not None:
+        traces.append(trace.to_dict())
 
 # output results
 def print_topres(results):
@@ -228,12 +599,17 @@ def print_topres(results):
 
 def main():
     load_room_docstore()
+    load_query_cache()
+    preload_partitions()
     print("\nStudy Spot Seach (Early Demo)")
     print("Type a query. Optional commands:")
     print("     :cap N")
     print("     :dur MIN")
     print("     :clear")
+    print("     :metrics (per stage timings so far)")
     print("     quit/exit")
+    print("Query syntax: quiet AND private, NOT loud, -loud, \"tech enhanced\",")
+    print("     space:langson, feature:whiteboard, room:..., group cap:6 (at least 6 seats)")
 
     min_cap = None
     duration= None
@@ -244,6 +620,9 @@ def main():
             continue
         
         if query.lower() in {"quit", "exit"}:
+            save_query_cache()
+            save_partition_stats()
+            print(f"Stem cache hit rate: {STEM_CACHE.hit_rate():.1%}")
             break
 
         if query.startswith(":cap"):
@@ -262,6 +641,10 @@ def main():
             print(f"Filters cleared")
             continue
 
+        if query.startswith(":metrics"):
+            print(metrics.get_metrics().to_prometheus())
+            continue
+
         results = retrieve_5_rooms(query, min_capacity=min_cap, duration_minutes=(duration or 30), k=5)
         print_topres(results)
 
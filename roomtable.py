@@ -0,0 +1,164 @@
+import numpy as np
+from pathlib import Path
+from availability import (HEADER, NO_START, SLOT_COUNT, SLOT_WIDTH, feasible_start_slots, pack_bitset, record_size,
+                          table_offset)
+from indexer import (ROOM_COLUMN_FIELDS, ROOM_COLUMNS_HEADER, ROOM_COLUMNS_MAGIC, ROOM_COLUMNS_VERSION,
+                     room_columns)
+
+# columnar view of the docstore, one row per room doc id
+# filters run as whole array masks instead of one python iteration per room
+# the columns come from the room columns file written at index time (see indexer.ROOM_COLUMNS_NAME),
+# docstore records are only decoded for rows the file doesn't have (indexes built before it)
+
+COLUMNS_DTYPE = np.dtype([(name, "<f8" if kind == "d" else "<i4") for name, kind in ROOM_COLUMN_FIELDS])
+
+
+def read_room_columns(path, limit):
+    # structured array of the first limit records, empty when the file is missing or unreadable
+    path = Path(path)
+    if not path.exists():
+        return np.zeros(0, dtype=COLUMNS_DTYPE)
+    with open(path, "rb") as f:
+        magic, version = ROOM_COLUMNS_HEADER.unpack(f.read(ROOM_COLUMNS_HEADER.size))
+        if magic != ROOM_COLUMNS_MAGIC or version != ROOM_COLUMNS_VERSION:
+            print(f"Ignoring room columns {path}: version {version}, expected {ROOM_COLUMNS_VERSION}")
+            return np.zeros(0, dtype=COLUMNS_DTYPE)
+        count = (path.stat().st_size - ROOM_COLUMNS_HEADER.size) // COLUMNS_DTYPE.itemsize
+        return np.fromfile(f, dtype=COLUMNS_DTYPE, count=min(count, limit))
+
+
+class RoomTable:
+    def __init__(self, docstore, availability=None, columns_path=None):
+        # docstore: DocStore (or {room doc id: meta}), ids are docstore line numbers (0 .. n-1)
+        n = len(docstore)
+        self.n = n
+        self.availability = availability
+
+        # space codes follow the spaces table, the same numbering the indexer wrote
+        self.space_ids = []
+        self.space_names = []
+        self.space_locations = []
+        space_codes = {}
+        for space in getattr(docstore, "spaces", {}).values():
+            self.add_space(space, space_codes)
+
+        table = np.zeros(n, dtype=COLUMNS_DTYPE)
+        stored = read_room_columns(columns_path, n) if columns_path else table[:0]
+        table[:len(stored)] = stored
+        for roomdoc_id in range(len(stored), n):
+            meta = docstore[roomdoc_id]
+            columns = room_columns(meta)
+            table[roomdoc_id] = columns[:-1] + (self.add_space(meta["space"], space_codes),)
+
+        self.capacity = np.ascontiguousarray(table["capacity"])
+        self.space_code = np.ascontiguousarray(table["space_code"])
+        self.lat = np.ascontiguousarray(table["lat"])
+        self.lon = np.ascontiguousarray(table["lon"])
+        self.day_start = np.ascontiguousarray(table["day_start"])
+        self.slot_minutes = np.ascontiguousarray(table["slot_minutes"])
+        self.doc_len = np.ascontiguousarray(table["doc_len"])
+
+        self.space_lat = np.array([loc[0] if loc else np.nan for loc in self.space_locations], dtype=float)
+        self.space_lon = np.array([loc[1] if loc else np.nan for loc in self.space_locations], dtype=float)
+
+        self.num_docs = n
+        self.avg_doc_len = float(np.nanmean(self.doc_len)) if np.any(~np.isnan(self.doc_len)) else 1.0
+        self.doc_len[np.isnan(self.doc_len)] = self.avg_doc_len
+
+        self.longest_free = None  # see longest_free_minutes
+
+        # without a hot store keep our own packed copy in the same record layout
+        self.packed = None
+        if availability is None:
+            bitsets = [meta["room"].get("slots_bitset", "") for _, meta in sorted(docstore.items())]
+            width = max([SLOT_WIDTH] + [len(b) for b in bitsets])
+            self.width = width
+            packed = b"".join(pack_bitset(b, width) for b in bitsets)
+            self.packed = np.frombuffer(packed, dtype=np.uint8).reshape(n, record_size(width))
+        else:
+            self.width = availability.width
+
+    def add_space(self, space, space_codes):
+        # code of the space id, new ids get the next one
+        code = space_codes.get(space["id"])
+        if code is None:
+            code = space_codes[space["id"]] = len(self.space_ids)
+            self.space_ids.append(space["id"])
+            self.space_names.append(space.get("name") or space["id"])
+            loc = space.get("location") or {}
+            has_loc = loc.get("lat") is not None and loc.get("lon") is not None
+            self.space_locations.append((loc["lat"], loc["lon"]) if has_loc else None)
+        return code
+
+    def records(self, rows):
+        # raw availability records (see availability.py), one row per room
+        if self.packed is not None:
+            records = self.packed[rows]
+        else:
+            store = self.availability
+            if len(rows) and rows.max() >= store.mapped_count:
+                store.remap()
+            # short lived view -> the store can still be remapped / closed later
+            view = np.frombuffer(store.mm, dtype=np.uint8, count=store.mapped_count * store.rec_size,
+                                 offset=HEADER.size).reshape(store.mapped_count, store.rec_size)
+            records = view[rows]
+            del view
+        return records
+
+    def first_free_slots(self, rows, duration_minutes):
+        # first start of a run of free slots long enough, -1 if none
+        # one lookup per room in the earliest start table precomputed at index time
+        first = np.full(len(rows), -1, dtype=np.int64)
+        if not len(rows):
+            return first
+
+        needed = np.maximum(1, -(-duration_minutes // self.slot_minutes[rows]))
+        fits = needed <= self.width
+        if not fits.any():
+            return first
+
+        records = self.records(rows[fits])
+        starts = records[np.arange(len(records)), table_offset(self.width) + needed[fits] - 1].astype(np.int64)
+        first[fits] = np.where(starts == NO_START, -1, starts)
+        return first
+
+    def free_start_slots(self, row, duration_minutes):
+        # every start slot of a free run long enough for one room, ascending
+        # the earliest start table gives the first one, the bits past it give the rest
+        needed = max(1, -(-duration_minutes // int(self.slot_minutes[row])))
+        if needed > self.width:
+            return []
+        record = self.records(np.array([row]))[0]
+        first = int(record[table_offset(self.width) + needed - 1])
+        if first == NO_START:
+            return []
+        mask = int.from_bytes(record[SLOT_COUNT.size:table_offset(self.width)].tobytes(), "little")
+        return [first + i for i in feasible_start_slots(mask >> first, needed)]
+
+    def free_run_minutes(self, rows):
+        # longest free run per room: entry n - 1 of the earliest start table is set <=> a run of n slots
+        start = table_offset(self.width)
+        runs = (self.records(rows)[:, start:start + self.width] != NO_START).sum(axis=1)
+        return runs * self.slot_minutes[rows]
+
+    def longest_free_minutes(self):
+        # every room, computed once per table
+        if self.longest_free is None:
+            self.longest_free = self.free_run_minutes(np.arange(self.n))
+        return self.longest_free
+
+    def refresh_rows(self, rows):
+        # rooms whose availability records were rewritten in place
+        if self.longest_free is not None and len(rows):
+            self.longest_free[rows] = self.free_run_minutes(rows)
+
+    def start_minutes(self, rows, slots):
+        return self.day_start[rows] + slots * self.slot_minutes[rows]
+
+    def user_free_mask(self, rows, slots, duration_minutes, user_free_times):
+        # the booking [start, start + duration) fits inside one of the user's free windows
+        free = np.asarray(user_free_times, dtype=np.int64).reshape(-1, 2)
+        starts = self.start_minutes(rows, slots)
+        ends = starts + duration_minutes
+        fits = (free[None, :, 0] <= starts[:, None]) & (ends[:, None] <= free[None, :, 1])
+        return fits.any(axis=1)
@@ -0,0 +1,188 @@
+import json
+import os
+import shutil
+import time
+import zlib
+from pathlib import Path
+
+# index segments: every build goes to its own directory, published atomically
+#
+#   Index/CURRENT            name of the live segment, swapped with os.replace
+#   Index/seg-000003/        partitions, routing table, docmap, docstore, availability,
+#                            index manifest and segment.json (header + per block crc32)
+#
+# appendable files (docmap, docstore, docstore offsets, spaces, room columns) are checked on the prefix
+# written at build time, the availability store is patched in place so it has no checksum
+
+SEGMENT_FORMAT = 1
+SEGMENT_HEADER = "segment.json"
+CURRENT_NAME = "CURRENT"
+SEGMENT_PREFIX = "seg-"
+CHECKSUM_BLOCK = 64 * 1024
+
+APPENDABLE_FILES = {"roomdocmap.tsv", "roomdocstore.jsonl", "roomdocstore.off", "roomspaces.jsonl", "roomcolumns.bin"}
+MUTABLE_FILES = {"roomavail.bin", "index_manifest.json", SEGMENT_HEADER}
+
+
+def segment_name(n):
+    return f"{SEGMENT_PREFIX}{n:06d}"
+
+def list_segments(root):
+    segments = []
+    for p in Path(root).glob(f"{SEGMENT_PREFIX}*"):
+        suffix = p.name[len(SEGMENT_PREFIX):]
+        if p.is_dir() and suffix.isdigit():
+            segments.append(p)
+    return sorted(segments)
+
+def current_segment_dir(root):
+    # flat (pre segment) index folders are their own segment
+    root = Path(root)
+    try:
+        with open(root / CURRENT_NAME, "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return root
+    return root / name
+
+def new_segment_dir(root):
+    # build happens in a .tmp folder, publish_segment renames it into place
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    segments = list_segments(root)
+    n = int(segments[-1].name[len(SEGMENT_PREFIX):]) + 1 if segments else 1
+    tmp_dir = root / (segment_name(n) + ".tmp")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir()
+    return tmp_dir
+
+def block_checksums(path, limit=None):
+    crcs = []
+    remaining = limit
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            n = CHECKSUM_BLOCK if remaining is None else min(CHECKSUM_BLOCK, remaining)
+            block = f.read(n)
+            if not block:
+                break
+            crcs.append(zlib.crc32(block))
+            if remaining is not None:
+                remaining -= len(block)
+    return crcs
+
+def file_checksum_entry(path):
+    return {
+        "size": path.stat().st_size,
+        "appendable": path.name in APPENDABLE_FILES,
+        "crc32": block_checksums(path)
+    }
+
+def save_segment_header(seg_dir, header):
+    path = Path(seg_dir) / SEGMENT_HEADER
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(header, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def write_segment_header(seg_dir, generation, **info):
+    seg_dir = Path(seg_dir)
+    files = {}
+    for p in sorted(seg_dir.iterdir()):
+        if p.is_file() and p.name not in MUTABLE_FILES:
+            files[p.name] = file_checksum_entry(p)
+
+    header = dict(info, format=SEGMENT_FORMAT, generation=generation, created=time.time(),
+                  block_size=CHECKSUM_BLOCK, files=files)
+    save_segment_header(seg_dir, header)
+    return header
+
+def add_segment_files(seg_dir, names, generation):
+    # incremental updates add delta runs to the live segment, only those get checksummed
+    seg_dir = Path(seg_dir)
+    header = read_segment_header(seg_dir)
+    for name in names:
+        header["files"][name] = file_checksum_entry(seg_dir / name)
+    header["generation"] = generation
+    save_segment_header(seg_dir, header)
+
+def read_segment_header(seg_dir):
+    path = Path(seg_dir) / SEGMENT_HEADER
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        header = json.load(f)
+    if header.get("format") != SEGMENT_FORMAT:
+        raise ValueError(f"{seg_dir} has segment format {header.get('format')}, expected {SEGMENT_FORMAT}")
+    return header
+
+def verify_segment(seg_dir, full=False):
+    '''
+    returns a list of problems, empty when the segment is intact
+    sizes are always checked, full=True re-reads every block
+    '''
+    seg_dir = Path(seg_dir)
+    header = read_segment_header(seg_dir)
+    if header is None:
+        return [f"{seg_dir} has no {SEGMENT_HEADER}"]
+
+    problems = []
+    for name, meta in header["files"].items():
+        p = seg_dir / name
+        if not p.exists():
+            problems.append(f"{name} is missing")
+            continue
+        size = p.stat().st_size
+        if size < meta["size"] or (size != meta["size"] and not meta["appendable"]):
+            problems.append(f"{name} is {size} bytes, expected {meta['size']}")
+            continue
+        if full and block_checksums(p, limit=meta["size"]) != meta["crc32"]:
+            problems.append(f"{name} failed its checksum")
+    return problems
+
+def fsync_dir(path):
+    # directory entries only need syncing where the os supports it
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def publish_segment(root, tmp_dir, keep=2):
+    # rename the finished build into place, then swap CURRENT to it
+    root = Path(root)
+    tmp_dir = Path(tmp_dir)
+    for p in tmp_dir.iterdir():
+        if p.is_file():
+            with open(p, "rb") as f:
+                os.fsync(f.fileno())
+
+    final_dir = tmp_dir.with_name(tmp_dir.name[:-len(".tmp")])
+    os.replace(tmp_dir, final_dir)
+    fsync_dir(root)
+
+    current_tmp = root / (CURRENT_NAME + ".tmp")
+    with open(current_tmp, "w", encoding="utf-8") as f:
+        f.write(final_dir.name + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(current_tmp, root / CURRENT_NAME)
+    fsync_dir(root)
+
+    cleanup_segments(root, keep)
+    return final_dir
+
+def cleanup_segments(root, keep=2):
+    # the previous segment stays around for readers that still have it open
+    for seg_dir in list_segments(root)[:-keep]:
+        try:
+            shutil.rmtree(seg_dir)
+        except OSError as e:
+            print(f"Could not remove old segment {seg_dir}: {e}")
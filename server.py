@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import retrieval
+from metrics import MetricsRegistry, describe_query_metrics, record_trace
+
+# long running query server: HTTP/1.1 + JSON on asyncio, index loaded once per worker
+#
+#   POST /search  {"query": "quiet group", "min_capacity": 4, "duration_minutes": 60, "k": 5,
+#                  "user_location": [lat, lon], "max_distance_m": 500, "free_times": [[start min, end min], ...]}
+#   POST /batch   {"requests": [<search body>, ...]}
+#   GET  /health, GET /stats
+#   GET  /metrics (prometheus text), GET /metrics.json
+#
+# scoring runs in a process pool (each worker maps the index at startup), requests that arrive
+# within BATCH_WINDOW_MS of each other are sent to a worker together
+# workers send back a trace per query, the server keeps the metrics registry for all of them
+
+HOST = "127.0.0.1"
+PORT = 8125
+BATCH_WINDOW_MS = 2
+MAX_BATCH = 32
+MAX_BODY_BYTES = 1 << 20
+
+
+class BadRequest(Exception):
+    pass
+
+
+# worker side
+def init_worker():
+    retrieval.load_room_docstore()
+    retrieval.preload_partitions()
+
+def parse_search(req):
+    if not isinstance(req, dict) or not isinstance(req.get("query"), str):
+        raise BadRequest("expected a json object with a \"query\" string")
+
+    location = req.get("user_location")
+    free_times = req.get("free_times")
+    try:
+        return {
+            "query": req["query"],
+            "min_capacity": int(req["min_capacity"]) if req.get("min_capacity") is not None else None,
+            "duration_minutes": int(req.get("duration_minutes") or 30),
+            "k": int(req.get("k") or 5),
+            "user_location": (float(location[0]), float(location[1])) if location else None,
+            "max_distance_m": float(req["max_distance_m"]) if req.get("max_distance_m") is not None else None,
+            # no free_times -> no calendar constraint, the server has no study_plan.txt of its own
+            "user_free_times": [(int(s), int(e)) for s, e in free_times] if free_times else []
+        }
+    except (TypeError, ValueError, IndexError) as e:
+        raise BadRequest(f"bad search parameters: {e}")
+
+def format_results(results):
+    out = []
+    for roomdoc_id, match_count, start_time, matched_terms in results:
+        meta = retrieval.ROOMDOCSTORE[roomdoc_id]
+        out.append({
+            "roomdoc_id": roomdoc_id,
+            "uid": meta["uid"],
+            "space": meta["space"]["name"],
+            "room": meta["room"]["name"],
+            "capacity": meta["room"]["capacity"],
+            "match_count": match_count,
+            "start_time": start_time,
+            "matched_terms": sorted(matched_terms)
+        })
+    return out
+
+def run_batch(reqs):
+    # one worker task per batch, postings and availability are shared through retrieve_batch
+    # a bad request only fails itself, returns (responses, query traces)
+    responses = [None] * len(reqs)
+    positions, queries, filters = [], [], []
+    for i, req in enumerate(reqs):
+        try:
+            search = parse_search(req)
+        except BadRequest as e:
+            responses[i] = {"error": str(e)}
+            continue
+        positions.append(i)
+        queries.append(search.pop("query"))
+        filters.append(search)
+
+    traces = []
+    for i, results in zip(positions, retrieval.retrieve_batch(queries, filters, verbose=False, traces=traces)):
+        responses[i] = {"results": format_results(results)}
+    return responses, traces
+
+
+# server side
+class Batcher:
+    def __init__(self, executor, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH, metrics=None):
+        self.executor = executor
+        self.metrics = metrics
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.pending = []
+        self.flush_task = None
+        self.batches = 0
+
+    async def submit(self, req):
+        fut = asyncio.get_running_loop().create_future()
+        self.pending.append((req, fut))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+        return await fut
+
+    async def flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        self.flush()
+
+    def flush(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+        if batch:
+            # batches run concurrently, one per free worker
+            asyncio.ensure_future(self.run(batch))
+        if self.pending:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+
+    async def run(self, batch):
+        self.batches += 1
+        loop = asyncio.get_running_loop()
+        try:
+            responses, traces = await loop.run_in_executor(self.executor, run_batch, [req for req, _ in batch])
+        except Exception as e:
+            responses, traces = [{"error": f"worker failed: {e}"}] * len(batch), []
+
+        if self.metrics is not None:
+            # the slow query log (if any) was written by the worker already
+            for trace in traces:
+                record_trace(trace, self.metrics, slow_log=False)
+            self.metrics.observe("batch_size", len(batch))
+        for (_, fut), response in zip(batch, responses):
+            if not fut.done():
+                fut.set_result(response)
+
+
+class QueryServer:
+    def __init__(self, executor, workers, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH):
+        self.metrics = MetricsRegistry()
+        describe_query_metrics(self.metrics)
+        self.metrics.describe("batch_size", "Requests per worker batch", buckets=(1, 2, 4, 8, 16, 32, 64))
+        self.batcher = Batcher(executor, window_ms, max_batch, self.metrics)
+        self.workers = workers
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+
+    async def route(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+
+        if method == "GET" and path == "/stats":
+            return 200, {
+                "uptime_seconds": round(time.time() - self.started, 3),
+                "workers": self.workers,
+                "requests": self.requests,
+                "errors": self.errors,
+                "batches": self.batcher.batches
+            }
+
+        if method == "GET" and path == "/metrics":
+            # str payload -> sent as text/plain (prometheus exposition format)
+            return 200, self.metrics.to_prometheus()
+
+        if method == "GET" and path == "/metrics.json":
+            return 200, self.metrics.snapshot()
+
+        if method != "POST" or path not in ("/search", "/batch"):
+            return 404, {"error": f"no route for {method} {path}"}
+
+        try:
+            req = json.loads(body or b"{}")
+        except ValueError as e:
+            return 400, {"error": f"invalid json: {e}"}
+
+        if path == "/search":
+            response = await self.batcher.submit(req)
+            return (400 if "error" in response else 200), response
+
+        reqs = req.get("requests") if isinstance(req, dict) else None
+        if not isinstance(reqs, list):
+            return 400, {"error": "expected a json object with a \"requests\" list"}
+        responses = await asyncio.gather(*(self.batcher.submit(r) for r in reqs))
+        return 200, {"responses": responses}
+
+    async def handle(self, reader, writer):
+        # keep-alive loop, one request at a time per connection
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    break
+                method, path, _ = parts
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    status, payload = 413, {"error": "request body too large"}
+                    body = None
+                else:
+                    body = await reader.readexactly(length) if length else b""
+
+                if body is not None:
+                    self.requests += 1
+                    try:
+                        status, payload = await self.route(method, path.split("?", 1)[0], body)
+                    except Exception as e:
+                        status, payload = 500, {"error": str(e)}
+                if status >= 400:
+                    self.errors += 1
+
+                keep_alive = headers.get("connection", "").lower() != "close" and body is not None
+                if isinstance(payload, str):
+                    data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+                else:
+                    data, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json"
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'OK')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Payload Too Large",
+    500: "Internal Server Error"
+}
+
+
+def make_executor(workers):
+    # workers = 0 -> everything in this process (one scoring thread), handy for debugging
+    if workers <= 0:
+        init_worker()
+        return ThreadPoolExecutor(max_workers=1)
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+
+async def serve(host=HOST, port=PORT, workers=None, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    executor = make_executor(workers)
+    query_server = QueryServer(executor, workers, window_ms, max_batch)
+
+    server = await asyncio.start_server(query_server.handle, host, port)
+    print(f"Serving study spot search on http://{host}:{port} with {workers} workers")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Study spot query server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=None, help="scoring processes (default: one per core, 0 = in process)")
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_MS)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.batch_window_ms, args.max_batch))
+    except KeyboardInterrupt:
+        print("Server stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# built-in porter stemmer, same output as nltk's PorterStemmer() (its default NLTK_EXTENSIONS mode)
+# so an index built with either one answers queries stemmed by the other.
+# importing nltk costs ~0.4 s per process, this module is plain python
+#
+# Porter, M. "An algorithm for suffix stripping." Program 14.3 (1980): 130-137
+
+VOWELS = frozenset("aeiou")
+
+# whole word exceptions from nltk
+IRREGULAR_FORMS = {
+    "sky": "sky", "skies": "sky",
+    "dying": "die", "lying": "lie", "tying": "tie",
+    "news": "news",
+    "innings": "inning", "inning": "inning",
+    "outings": "outing", "outing": "outing",
+    "cannings": "canning", "canning": "canning",
+    "howe": "howe",
+    "proceed": "proceed", "exceed": "exceed", "succeed": "succeed"
+}
+
+
+def consonant_flags(word):
+    # y is a consonant at the start or after a vowel
+    flags = []
+    for i, ch in enumerate(word):
+        if ch in VOWELS:
+            flags.append(False)
+        elif ch == "y":
+            flags.append(True if i == 0 else not flags[i - 1])
+        else:
+            flags.append(True)
+    return flags
+
+def is_consonant(word, i):
+    return consonant_flags(word)[i]
+
+def measure(stem):
+    # m in [C](VC){m}[V]
+    m = 0
+    prev_vowel = False
+    for cons in consonant_flags(stem):
+        if cons and prev_vowel:
+            m += 1
+        prev_vowel = not cons
+    return m
+
+def contains_vowel(stem):
+    return not all(consonant_flags(stem))
+
+def ends_double_consonant(word):
+    return len(word) >= 2 and word[-1] == word[-2] and is_consonant(word, len(word) - 1)
+
+def ends_cvc(word):
+    if len(word) >= 3:
+        flags = consonant_flags(word)
+        return flags[-3] and not flags[-2] and flags[-1] and word[-1] not in "wxy"
+    if len(word) == 2:
+        flags = consonant_flags(word)
+        return not flags[0] and flags[1]
+    return False
+
+def positive_measure(stem):
+    return measure(stem) > 0
+
+def measure_gt_1(stem):
+    return measure(stem) > 1
+
+
+def apply_rules(word, rules):
+    # the first rule whose suffix matches decides, even when its condition fails
+    for suffix, replacement, condition in rules:
+        if word.endswith(suffix):
+            stem = word[:len(word) - len(suffix)]
+            if condition is None or condition(stem):
+                return stem + replacement
+            return word
+    return word
+
+
+STEP1A_RULES = [("sses", "ss", None), ("ies", "i", None), ("ss", "ss", None), ("s", "", None)]
+
+STEP2_RULES = [
+    ("ational", "ate", positive_measure),
+    ("tional", "tion", positive_measure),
+    ("enci", "ence", positive_measure),
+    ("anci", "ance", positive_measure),
+    ("izer", "ize", positive_measure),
+    ("bli", "ble", positive_measure),
+    ("alli", "al", positive_measure),
+    ("entli", "ent", positive_measure),
+    ("eli", "e", positive_measure),
+    ("ousli", "ous", positive_measure),
+    ("ization", "ize", positive_measure),
+    ("ation", "ate", positive_measure),
+    ("ator", "ate", positive_measure),
+    ("alism", "al", positive_measure),
+    ("iveness", "ive", positive_measure),
+    ("fulness", "ful", positive_measure),
+    ("ousness", "ous", positive_measure),
+    ("aliti", "al", positive_measure),
+    ("iviti", "ive", positive_measure),
+    ("biliti", "ble", positive_measure),
+    ("fulli", "ful", positive_measure),
+    # the l of logi stays with the stem: geo-logi, theo-logi
+    ("logi", "log", lambda stem: positive_measure(stem + "l"))
+]
+
+STEP3_RULES = [
+    ("icate", "ic", positive_measure),
+    ("ative", "", positive_measure),
+    ("alize", "al", positive_measure),
+    ("iciti", "ic", positive_measure),
+    ("ical", "ic", positive_measure),
+    ("ful", "", positive_measure),
+    ("ness", "", positive_measure)
+]
+
+STEP4_RULES = [
+    ("al", "", measure_gt_1),
+    ("ance", "", measure_gt_1),
+    ("ence", "", measure_gt_1),
+    ("er", "", measure_gt_1),
+    ("ic", "", measure_gt_1),
+    ("able", "", measure_gt_1),
+    ("ible", "", measure_gt_1),
+    ("ant", "", measure_gt_1),
+    ("ement", "", measure_gt_1),
+    ("ment", "", measure_gt_1),
+    ("ent", "", measure_gt_1),
+    ("ion", "", lambda stem: measure(stem) > 1 and stem[-1] in "st"),
+    ("ou", "", measure_gt_1),
+    ("ism", "", measure_gt_1),
+    ("ate", "", measure_gt_1),
+    ("iti", "", measure_gt_1),
+    ("ous", "", measure_gt_1),
+    ("ive", "", measure_gt_1),
+    ("ize", "", measure_gt_1)
+]
+
+
+def step1a(word):
+    if word.endswith("ies") and len(word) == 4:
+        return word[:-3] + "ie"
+    return apply_rules(word, STEP1A_RULES)
+
+def step1b(word):
+    if word.endswith("ied"):
+        return word[:-3] + ("ie" if len(word) == 4 else "i")
+
+    if word.endswith("eed"):
+        stem = word[:-3]
+        return stem + "ee" if measure(stem) > 0 else word
+
+    for suffix in ("ed", "ing"):
+        if word.endswith(suffix) and contains_vowel(word[:-len(suffix)]):
+            stem = word[:-len(suffix)]
+            break
+    else:
+        return word
+
+    # tidy up after -ed / -ing
+    for suffix in ("at", "bl", "iz"):
+        if stem.endswith(suffix):
+            return stem + "e"
+    if ends_double_consonant(stem):
+        return stem[:-1] if stem[-1] not in "lsz" else stem
+    if measure(stem) == 1 and ends_cvc(stem):
+        return stem + "e"
+    return stem
+
+def step1c(word):
+    # y -> i after a consonant that is not the whole stem: happy -> happi, enjoy stays
+    if word.endswith("y") and len(word) > 2 and is_consonant(word, len(word) - 2):
+        return word[:-1] + "i"
+    return word
+
+def step2(word):
+    # alli -> al first, the result goes through step 2 again
+    if word.endswith("alli") and positive_measure(word[:-4]):
+        return step2(word[:-4] + "al")
+    return apply_rules(word, STEP2_RULES)
+
+def step3(word):
+    return apply_rules(word, STEP3_RULES)
+
+def step4(word):
+    return apply_rules(word, STEP4_RULES)
+
+def step5a(word):
+    if word.endswith("e"):
+        stem = word[:-1]
+        m = measure(stem)
+        if m > 1 or (m == 1 and not ends_cvc(stem)):
+            return stem
+    return word
+
+def step5b(word):
+    if word.endswith("ll") and measure(word[:-1]) > 1:
+        return word[:-1]
+    return word
+
+
+class PorterStemmer:
+    # same interface as nltk.stem.PorterStemmer: stem(word)
+    def stem(self, word):
+        stem = word.lower()
+        if stem in IRREGULAR_FORMS:
+            return IRREGULAR_FORMS[stem]
+        if len(word) <= 2:
+            return stem
+        for step in (step1a, step1b, step1c, step2, step3, step4, step5a, step5b):
+            stem = step(stem)
+        return stem
@@ -0,0 +1,121 @@
+import json
+import os
+import re
+from pathlib import Path
+from stemmer import PorterStemmer
+
+# shared tokenizer for the indexer and query normalization
+# the vocabulary is tiny compared to the token count, so stems are memoized per surface token
+#
+# stemmers: "porter" (built in, stemmer.py) or "nltk" (imported only when picked),
+# both give the same stems so the index does not care which one built it
+
+TOKEN_RE = re.compile(r"\b[a-zA-Z0-9]+\b")
+STEM_CACHE_NAME = "stem_cache.json"
+STEM_CACHE_SIZE = 65536
+STEMMER = os.environ.get("STUDY_BUDDIES_STEMMER", "porter")
+
+
+def nltk_stemmer():
+    from nltk.stem import PorterStemmer as NltkPorterStemmer
+    return NltkPorterStemmer()
+
+STEMMERS = {
+    "porter": PorterStemmer,
+    "nltk": nltk_stemmer
+}
+
+def make_stemmer(name=None):
+    name = name or STEMMER
+    if name not in STEMMERS:
+        print(f"Unknown stemmer {name!r}, using porter")
+        name = "porter"
+    return STEMMERS[name]()
+
+
+class StemCache:
+    def __init__(self, max_entries=STEM_CACHE_SIZE, stemmer=None):
+        self.max_entries = max_entries
+        self.stemmer = stemmer if stemmer is not None else make_stemmer()
+        self.entries = {}  # token -> stem, insertion ordered
+        self.hits = 0
+        self.misses = 0
+
+    def stem(self, token):
+        stem = self.entries.get(token)
+        if stem is not None:
+            self.hits += 1
+            return stem
+
+        self.misses += 1
+        stem = self.stemmer.stem(token)
+        if len(self.entries) >= self.max_entries:
+            # oldest first, no reordering on hits keeps the lookup a plain dict get
+            del self.entries[next(iter(self.entries))]
+        self.entries[token] = stem
+        return stem
+
+    def update(self, entries):
+        for token, stem in entries.items():
+            if token not in self.entries and len(self.entries) < self.max_entries:
+                self.entries[token] = stem
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate()
+        }
+
+    # persisted next to the index so a new process starts with the corpus vocabulary
+    def save(self, path):
+        path = Path(path)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        path = Path(path)
+        if not path.exists():
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.update(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Ignoring stem cache {path}: {e}")
+
+
+STEM_CACHE = StemCache()
+
+def set_stemmer(stemmer):
+    # name from STEMMERS or any object with stem(word), cached stems are dropped
+    STEM_CACHE.stemmer = make_stemmer(stemmer) if isinstance(stemmer, str) else stemmer
+    STEM_CACHE.entries.clear()
+    return STEM_CACHE.stemmer
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+def stem_tokens(text):
+    # stems in text order, duplicates kept
+    stem = STEM_CACHE.stem
+    return [stem(tok) for tok in tokenize(text)]
+
+def tokenize_and_stem(text):
+    # return set of stems for this test -> binary presence
+    if not isinstance(text, str) or not text.strip():
+        return set()
+    return set(stem_tokens(text))
+
+def load_stem_cache(folder):
+    STEM_CACHE.load(Path(folder) / STEM_CACHE_NAME)
+
+def save_stem_cache(folder):
+    STEM_CACHE.save(Path(folder) / STEM_CACHE_NAME)